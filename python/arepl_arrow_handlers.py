@@ -0,0 +1,71 @@
+import pyarrow as pa
+
+import arepl_jsonpickle as jsonpickle
+import arepl_shared_memory
+from arepl_jsonpickle.handlers import BaseHandler
+from arepl_jsonpickle.util import b64decode, b64encode
+
+#####################################
+"""
+Arrow handlers for AREPL, only used if pyarrow is installed.
+Tables are sent as Arrow IPC stream bytes, so there are no python objects per cell
+and the frontend can read them with apache-arrow (tableFromIPC).
+The bytes are base64 in arrow_ipc, or {"py/shm": descriptor} if they were put in shared memory
+"""
+#####################################
+
+
+def flatten_table(table: pa.Table, data: dict) -> dict:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    buf = sink.getvalue()
+
+    if arepl_shared_memory.available and buf.size >= arepl_shared_memory.SIZE_THRESHOLD:
+        data["arrow_ipc"] = {"py/shm": arepl_shared_memory.write_block(buf)}
+    else:
+        data["arrow_ipc"] = b64encode(buf)
+    data["shape"] = [table.num_rows, table.num_columns]
+    return data
+
+
+def restore_table(data: dict) -> pa.Table:
+    # shared memory is read by the frontend, so we only restore base64
+    return pa.ipc.open_stream(b64decode(data["arrow_ipc"])).read_all()
+
+
+class ArrowTableHandler(BaseHandler):
+    def flatten(self, obj, data):
+        return flatten_table(obj, data)
+
+    def restore(self, data):
+        return restore_table(data)
+
+
+class ArrowRecordBatchHandler(BaseHandler):
+    def flatten(self, obj, data):
+        return flatten_table(pa.Table.from_batches([obj]), data)
+
+    def restore(self, data):
+        return restore_table(data).to_batches()[0]
+
+
+class PolarsDfHandler(BaseHandler):
+    def flatten(self, obj, data):
+        return flatten_table(obj.to_arrow(), data)
+
+    def restore(self, data):
+        import polars as pl
+
+        return pl.from_arrow(restore_table(data))
+
+
+def register_handlers():
+    jsonpickle.handlers.register(pa.Table, ArrowTableHandler, base=True)
+    jsonpickle.handlers.register(pa.RecordBatch, ArrowRecordBatchHandler, base=True)
+
+
+def register_polars_handlers():
+    import polars as pl
+
+    jsonpickle.handlers.register(pl.DataFrame, PolarsDfHandler, base=True)
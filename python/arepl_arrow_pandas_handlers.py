@@ -0,0 +1,34 @@
+import pyarrow as pa
+
+import arepl_jsonpickle as jsonpickle
+from arepl_arrow_handlers import flatten_table, restore_table
+from arepl_pandas_handlers import PandasDfHandler, pd
+
+#####################################
+"""
+Sends full pandas dataframes as Arrow IPC, only used if both pandas and pyarrow are installed.
+This is kept apart from the arrow handlers so that using pyarrow does not import pandas
+"""
+#####################################
+
+
+class ArrowPandasDfHandler(PandasDfHandler):
+    """full dataframes are sent as arrow, unless arrow can't convert them (ex: columns with mixed types)"""
+
+    def flatten_full(self, obj, data):
+        try:
+            table = pa.Table.from_pandas(obj)
+        except Exception:
+            # not only arrow errors, ex: OverflowError for python ints too big for int64
+            # or ValueError for duplicate column names
+            return super().flatten_full(obj, data)
+        return flatten_table(table, data)
+
+    def restore(self, data):
+        if "arrow_ipc" in data:
+            return restore_table(data).to_pandas()
+        return super().restore(data)
+
+
+def register_handlers():
+    jsonpickle.handlers.register(pd.DataFrame, ArrowPandasDfHandler, base=True)
@@ -0,0 +1,54 @@
+"""
+Compares the jsonpickle dataframe encoder with the arepl one, which sends numeric columns as binary blocks.
+Run from the python folder: python -m arepl_benchmarks.bench_dataframe
+"""
+
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import arepl_jsonpickle as jsonpickle
+import arepl_jsonpickle.ext.pandas as jsonpickle_pandas
+import arepl_pandas_handlers
+import arepl_shared_memory
+from arepl_pickler import pickle_user_vars
+
+ROWS = 10**6
+
+
+def make_df(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "int": rng.integers(0, 1000, rows),
+            "float": rng.random(rows),
+            "float2": rng.random(rows),
+            "bool": rng.random(rows) > 0.5,
+            "datetime": pd.date_range("2000-01-01", periods=rows, freq="s"),
+            "str": np.array(["a", "bb", "ccc", "dddd"])[rng.integers(0, 4, rows)],
+        }
+    )
+
+
+def bench(df):
+    start = perf_counter()
+    payload = pickle_user_vars({"df": df})
+    return perf_counter() - start, len(payload)
+
+
+if __name__ == "__main__":
+    df = make_df(ROWS)
+    # we want the full data, not a preview
+    arepl_pandas_handlers.PREVIEW_ROW_THRESHOLD = ROWS
+
+    jsonpickle.handlers.register(pd.DataFrame, jsonpickle_pandas.PandasDfHandler, base=True)
+    old_time, old_size = bench(df)
+    jsonpickle.handlers.register(pd.DataFrame, arepl_pandas_handlers.PandasDfHandler, base=True)
+    new_time, new_size = bench(df)
+
+    print(f"{ROWS} rows, {len(df.columns)} columns")
+    print(f"jsonpickle: {old_time * 1000:.0f} ms, {old_size / 1e6:.1f} MB")
+    print(f"arepl:      {new_time * 1000:.0f} ms, {new_size / 1e6:.1f} MB")
+    print(f"speedup:    {old_time / new_time:.1f}x")
+    arepl_shared_memory.release_blocks()
@@ -0,0 +1,58 @@
+"""
+Compares the old nested-list numpy transport with the binary transport.
+Run from the python folder: python -m arepl_benchmarks.bench_numpy_transport
+With shared memory the payload is just a descriptor, arrays under 1 MB don't go through shared memory
+"""
+
+import json
+import zlib
+from time import perf_counter
+
+import numpy as np
+
+import arepl_numpy_handlers
+import arepl_shared_memory
+from arepl_pickler import pickle_user_vars, register_lazy_handlers
+
+SIZES = [10**4, 10**6, 10**7]
+
+# name: (handler options, whether to use shared memory)
+TRANSPORTS = {
+    "text (tolist)": (dict(size_threshold=None), False),
+    "binary": (dict(size_threshold=arepl_numpy_handlers.BINARY_SIZE_THRESHOLD), False),
+    "binary + zlib": (dict(size_threshold=arepl_numpy_handlers.BINARY_SIZE_THRESHOLD, compression=zlib), False),
+    "shared memory": (dict(size_threshold=arepl_numpy_handlers.BINARY_SIZE_THRESHOLD), True),
+}
+
+
+def bench(arr):
+    start = perf_counter()
+    payload = pickle_user_vars({"arr": arr})
+    encode_time = perf_counter() - start
+
+    start = perf_counter()
+    json.loads(payload)
+    parse_time = perf_counter() - start
+
+    return encode_time, parse_time, len(payload)
+
+
+if __name__ == "__main__":
+    # otherwise the first pickle would register the default handlers over the ones we are benchmarking
+    register_lazy_handlers()
+    rng = np.random.default_rng(0)
+    shared_memory_available = arepl_shared_memory.available
+    print(f"{'elements':>10} {'transport':>15} {'encode ms':>10} {'parse ms':>10} {'payload MB':>11}")
+    for size in SIZES:
+        arr = rng.random(size)
+        for name, (options, use_shared_memory) in TRANSPORTS.items():
+            if use_shared_memory and not shared_memory_available:
+                continue
+            arepl_numpy_handlers.register_handlers(**options)
+            arepl_shared_memory.available = use_shared_memory
+            encode_time, parse_time, payload_size = bench(arr)
+            print(
+                f"{size:>10} {name:>15} {encode_time * 1000:>10.1f} {parse_time * 1000:>10.1f} "
+                f"{payload_size / 1e6:>11.2f}"
+            )
+            arepl_shared_memory.release_blocks()
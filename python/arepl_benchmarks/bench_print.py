@@ -0,0 +1,45 @@
+"""
+Compares the throughput of print-heavy code with line buffered stdout and with arepl_stdout, which batches writes.
+Node reads stdout through a pipe, so a pipe drained by a thread stands in for it.
+Run from the python folder: python -m arepl_benchmarks.bench_print
+"""
+
+import os
+from io import TextIOWrapper
+from threading import Thread
+from time import perf_counter
+
+from arepl_stdout import CoalescingStdout
+
+LINES = 10**5
+
+
+def drain(read_end):
+    with open(read_end, "rb") as pipe:
+        while pipe.read1(1 << 16):
+            pass
+
+
+def bench(name, make_stdout):
+    read_end, write_end = os.pipe()
+    reader = Thread(target=drain, args=(read_end,))
+    reader.start()
+    stdout = make_stdout(write_end)
+    if isinstance(stdout, CoalescingStdout):
+        # like while the evaluator runs user code
+        stdout.start_flushing()
+
+    start = perf_counter()
+    for i in range(LINES):
+        print("line", i, file=stdout)
+    stdout.flush()
+    elapsed = perf_counter() - start
+
+    stdout.close()
+    reader.join()
+    print(f"{name}: {elapsed * 1000:.1f} ms for {LINES} lines")
+
+
+if __name__ == "__main__":
+    bench("line buffered", lambda fd: TextIOWrapper(open(fd, "wb"), line_buffering=True))
+    bench("arepl_stdout", CoalescingStdout)
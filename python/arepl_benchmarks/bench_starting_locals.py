@@ -0,0 +1,40 @@
+"""
+Measures the setup of the starting locals of a run (__name__, __file__, __loader__, etc.),
+which happens every run that doesn't use previous variables.
+Compared with deepcopying the starting locals of the module, like arepl used to.
+Run from the python folder: python -m arepl_benchmarks.bench_starting_locals
+"""
+
+from copy import deepcopy
+from os import path
+from timeit import timeit
+
+import arepl_custom_locals
+from arepl_var_filter import specialVars
+
+RUNS = 10**5
+FILE_PATH = "/home/user/script.py"
+
+_module_locals = {var: vars(arepl_custom_locals)[var] for var in specialVars}
+
+
+def deepcopy_starting_locals(filePath: str):
+    custom_locals = deepcopy(_module_locals)
+    custom_locals["__name__"] = "__main__"
+    custom_locals["__loader__"].name = "__main__"
+    del custom_locals["__spec__"]
+
+    custom_locals["__file__"] = filePath
+    if filePath:
+        custom_locals["__loader__"].path = path.basename(filePath)
+    return custom_locals
+
+
+def bench(name, get_starting_locals):
+    seconds = timeit(lambda: get_starting_locals(FILE_PATH), number=RUNS)
+    print(f"{name}: {seconds / RUNS * 10**6:.2f} us per run")
+
+
+if __name__ == "__main__":
+    bench("deepcopy", deepcopy_starting_locals)
+    bench("template", arepl_custom_locals.get_normal_starting_locals)
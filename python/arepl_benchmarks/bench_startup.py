@@ -0,0 +1,78 @@
+"""
+Measures how long it takes for the evaluator to be ready for code, like PythonExecutor does when it (re)starts.
+Executors are restarted after every run, so this is latency users feel.
+Run from the python folder: python -m arepl_benchmarks.bench_startup [number of runs]
+If the bundle has been built (see arepl_build_bundle.py) it is compared with the loose files
+Only works on unix, because the result stream has to be passed to the evaluator as fd 3
+"""
+
+import json
+import os
+import subprocess
+import sys
+from statistics import median, quantiles
+from time import time
+
+from arepl_build_bundle import BUNDLE_NAME
+
+RUNS = 30
+PYTHON_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_evaluator(script: str):
+    """
+    :returns: seconds until the start result was received and the startupTimes of the evaluator
+    """
+    read_end, write_end = os.pipe()
+    env = dict(os.environ)
+    spawn_time = time()
+    env["AREPL_SPAWN_TIME"] = str(int(spawn_time * 1000))
+    process = subprocess.Popen(
+        [sys.executable, script],
+        cwd=PYTHON_FOLDER,
+        env=env,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        # the evaluator writes results to fd 3
+        # close_fds would close it, as it runs after preexec_fn
+        close_fds=False,
+        preexec_fn=lambda: os.dup2(write_end, 3),
+    )
+    os.close(write_end)
+    with open(read_end) as result_stream:
+        start_result = json.loads(result_stream.readline())
+        ready_time = time() - spawn_time
+    process.kill()
+    process.wait()
+    return ready_time, start_result["startupTimes"]
+
+
+def percentile(values, percent):
+    return quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def bench(script: str, runs: int):
+    # the first start warms up the os file cache, it is not what users normally see
+    start_evaluator(script)
+
+    ready_times = []
+    phase_times = {}
+    for _ in range(runs):
+        ready_time, startup_times = start_evaluator(script)
+        ready_times.append(ready_time)
+        for phase, phase_time in startup_times.items():
+            phase_times.setdefault(phase, []).append(phase_time)
+
+    print(f"{script} time to ready over {runs} runs:")
+    print(f"  p50: {percentile(ready_times, 50) * 1000:.1f} ms")
+    print(f"  p95: {percentile(ready_times, 95) * 1000:.1f} ms")
+    print("median of each phase:")
+    for phase, times in phase_times.items():
+        print(f"  {phase}: {median(times) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    bench("arepl_python_evaluator.py", runs)
+    if os.path.exists(os.path.join(PYTHON_FOLDER, BUNDLE_NAME)):
+        bench(BUNDLE_NAME, runs)
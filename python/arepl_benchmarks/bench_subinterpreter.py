@@ -0,0 +1,45 @@
+"""
+Measures how long a run in a subinterpreter takes, with and without the interpreter created ahead of time,
+compared with running the code in the evaluator. Needs python 3.14+.
+Run from the python folder: python -m arepl_benchmarks.bench_subinterpreter
+"""
+
+import json
+from time import perf_counter
+
+import arepl_python_evaluator
+import arepl_subinterpreter
+
+RUNS = 20
+DATA = {
+    "evalCode": "x = 1",
+    "show_global_vars": True,
+    "default_filter_vars": [],
+    "default_filter_types": ["<class 'module'>", "<class 'function'>"],
+}
+
+
+def bench(name, run, prepare=lambda: None):
+    seconds = 0
+    for _ in range(RUNS):
+        prepare()
+        start = perf_counter()
+        run()
+        seconds += perf_counter() - start
+    print(f"{name}: {seconds / RUNS * 1000:.2f} ms per run")
+
+
+def create_interpreter():
+    # created by the run itself, like when there is no prepared interpreter
+    if arepl_subinterpreter._prepared is not None:
+        arepl_subinterpreter._prepared.close()
+        arepl_subinterpreter._prepared = None
+
+
+if __name__ == "__main__":
+    if not arepl_subinterpreter.available:
+        raise SystemExit("subinterpreters need python 3.14+")
+    json_input = json.dumps(DATA)
+    bench("evaluator", lambda: arepl_python_evaluator.run(DATA))
+    bench("new subinterpreter", lambda: arepl_subinterpreter.run(json_input), create_interpreter)
+    bench("prepared subinterpreter", lambda: arepl_subinterpreter.run(json_input), arepl_subinterpreter.prepare)
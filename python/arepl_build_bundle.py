@@ -0,0 +1,69 @@
+"""
+Builds arepl.pyz, a zipapp of the evaluator with precompiled bytecode.
+Starting from a single archive saves python from looking up and stat-ing every module of arepl,
+and the bytecode is used even if the python folder is not writable (so __pycache__ can't be written).
+PythonExecutor launches the bundle instead of arepl_python_evaluator.py if it is newer than the python files,
+so remember to rebuild it after changing the python files.
+Usage: python arepl_build_bundle.py
+"""
+
+import os
+import py_compile
+import sys
+import tempfile
+import zipfile
+
+PYTHON_FOLDER = os.path.dirname(os.path.abspath(__file__))
+BUNDLE_NAME = "arepl.pyz"
+EXCLUDED = ["arepl_build_bundle.py", "arepl_examples.py", "arepl_benchmarks", "testDataFiles"]
+# level 2 removes asserts and docstrings, arepl does not rely on either
+OPTIMIZE = 2
+
+MAIN = f"""import runpy
+import sys
+from os import path
+
+if sys.implementation.cache_tag != {sys.implementation.cache_tag!r}:
+    # The bytecode is for another python version, so python would have to compile the bundled source on every start.
+    # The files next to the bundle are faster, as python caches their bytecode
+    sys.path[0] = path.dirname(sys.path[0])
+
+runpy.run_module("arepl_python_evaluator", run_name="__main__", alter_sys=True)
+"""
+
+
+def get_sources():
+    """
+    :returns: paths of the python files of the evaluator, relative to the python folder
+    """
+    sources = []
+    for folder, dirs, files in os.walk(PYTHON_FOLDER):
+        dirs[:] = [d for d in dirs if d not in EXCLUDED and d != "__pycache__"]
+        for file in files:
+            if file.endswith(".py") and file not in EXCLUDED and not file.startswith("test_"):
+                sources.append(os.path.relpath(os.path.join(folder, file), PYTHON_FOLDER))
+    return sorted(sources)
+
+
+def build_bundle(bundle_path=os.path.join(PYTHON_FOLDER, BUNDLE_NAME)):
+    with zipfile.ZipFile(bundle_path, "w") as bundle, tempfile.TemporaryDirectory() as temp_folder:
+        bundle.writestr("__main__.py", MAIN)
+        for source in get_sources():
+            archive_path = source.replace(os.sep, "/")
+            pyc = py_compile.compile(
+                os.path.join(PYTHON_FOLDER, source),
+                cfile=os.path.join(temp_folder, source + "c"),
+                dfile=archive_path,
+                doraise=True,
+                optimize=OPTIMIZE,
+                # zipimport would compare a timestamp with the one of the source in the archive, which is pointless
+                invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+            )
+            bundle.write(pyc, archive_path + "c")
+            # the source is kept for tracebacks and for python versions that can't use the bytecode
+            bundle.write(os.path.join(PYTHON_FOLDER, source), archive_path)
+    return bundle_path
+
+
+if __name__ == "__main__":
+    print(f"built {build_bundle()}")
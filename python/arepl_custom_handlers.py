@@ -1,11 +1,13 @@
 import re
 import datetime
 import decimal
+import arepl_jsonpickle as jsonpickle
 from arepl_jsonpickle.handlers import BaseHandler
 from io import TextIOWrapper
 from types import CodeType, FrameType, GeneratorType
 
 NOT_SERIALIZABLE_MESSAGE = "not serializable by arepl"
+FRAMES_NOT_SHOWN_MESSAGE = "older frames are not shown by arepl"
 
 
 class BaseCustomHandler(BaseHandler):
@@ -42,12 +44,17 @@ class RegexMatchHandler(BaseCustomHandler):
 
 class FrameHandler(BaseCustomHandler):
     ### better represention of frame, see https://github.com/Almenon/AREPL-backend/issues/26 ###
-    def flatten(self, obj, data):
+    # frames of deep recursion would make a huge payload, so f_back is only followed this far
+    MAX_DEPTH = 20
+
+    def flatten(self, obj, data, depth=0):
         if obj is None:
             return None
+        if depth >= self.MAX_DEPTH:
+            return FRAMES_NOT_SHOWN_MESSAGE
         return {
             "py/object": "types.FrameType",
-            "f_back": self.flatten(obj.f_back, data),
+            "f_back": self.flatten(obj.f_back, data, depth + 1),
             "f_builtins": NOT_SERIALIZABLE_MESSAGE,
             "f_code": CodeHandler(None).flatten(obj.f_code, data),
             "f_globals": NOT_SERIALIZABLE_MESSAGE,
@@ -103,6 +110,33 @@ class TextIOHandler(BaseHandler):
         return obj_repr
 
 
+class RowPage:
+    """
+    rows start to stop of obj.
+    Big objects are normally sent as a preview, this is for when the user asks to see the full rows
+    """
+
+    def __init__(self, obj, start: int, stop: int):
+        self.obj = obj
+        self.start = start
+        self.stop = stop
+
+
+class RowPageHandler(BaseCustomHandler):
+    def flatten(self, obj, data):
+        rows = obj.obj.iloc[obj.start : obj.stop] if hasattr(obj.obj, "iloc") else obj.obj[obj.start : obj.stop]
+        handler = jsonpickle.handlers.get(type(rows))
+        if handler is not None and hasattr(handler, "flatten_full"):
+            data = handler(self.context).flatten_full(rows, data)
+        else:
+            data["values"] = self.context.flatten(rows, reset=False)
+        # the frontend should see this as the original type, just with less rows
+        data["py/object"] = jsonpickle.util.importable_name(type(obj.obj))
+        data["page"] = [obj.start, obj.stop]
+        data["total_rows"] = len(obj.obj)
+        return data
+
+
 handlers = [
     {"type": datetime.date, "handler": DatetimeHandler},
     {"type": datetime.time, "handler": DatetimeHandler},
@@ -113,4 +147,5 @@ handlers = [
     {"type": decimal.Decimal, "handler": DecimalHandler},
     {"type": GeneratorType, "handler": GeneratorHandler},
     {"type": TextIOWrapper, "handler": TextIOHandler},
+    {"type": RowPage, "handler": RowPageHandler},
 ]
@@ -1,26 +1,25 @@
-from copy import deepcopy
+from importlib.machinery import SourceFileLoader
 from os import path
 import arepl_overloads
-from arepl_pickler import specialVars
+from arepl_var_filter import specialVars
 
-_starting_locals = {}
-for var in specialVars:
-    _starting_locals[var] = locals()[var]
+# the starting locals that are the same every run. The values are immutable, so runs can share them
+_starting_locals = {var: globals()[var] for var in specialVars if var != "__spec__"}
+_starting_locals["__name__"] = "__main__"
+# the loader of a normal run has the path of the script, if there is no script we use the path of this file
+_default_loader_path = getattr(__loader__, "path", __file__)
 
 
 def get_normal_starting_locals(filePath: str):
     """
     returns the starting locals one would see on a normal run of python (without arepl)
     """
-    custom_locals = deepcopy(_starting_locals)
-    custom_locals["__name__"] = "__main__"
-    custom_locals["__loader__"].name = "__main__"
-    del custom_locals["__spec__"]
-
+    custom_locals = _starting_locals.copy()
     custom_locals["__file__"] = filePath
-    if filePath:
-        custom_locals["__loader__"].path = path.basename(filePath)
-
+    # a new loader every run, as user code may change it
+    custom_locals["__loader__"] = SourceFileLoader(
+        "__main__", path.basename(filePath) if filePath else _default_loader_path
+    )
     return custom_locals
 
 
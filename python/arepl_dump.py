@@ -1,52 +1,144 @@
-import inspect
+import sys
 from time import time
 from typing import Any, List, Union
 from arepl_python_evaluator import pickle_user_vars, ReturnInfo, print_output
+import arepl_result_stream
+from arepl_pickler import pickle_object
 from arepl_settings import get_settings
+from arepl_history import VariableHistory
 
+# number of calls of each dump, keyed by the id of the calling code object and the offset of the call in it
 context = {}
+# the calling code objects, so their ids can't be reused by other code objects during the run
+callers = []
+# time of the last dump of each dump with minIntervalMs
+last_dump_times = {}
+# frame, variable, line and count of the latest call of each dump with lastOnly, dumped at the end of the run
+pending_dumps = {}
+# calls that were not dumped because of every, minIntervalMs or lastOnly
+suppressed = 0
+# values recorded by each dump with record
+histories = {}
 
 
-def dump(variable: Any = None, atCount: Union[int, List[int]] = 0):
+def reset():
     """
-    dumps specified var to arepl viewer or all vars of calling scope if unspecified
-    :param atCount: when to dump. ex: dump(,3) to dump vars at fourth iteration of loop. You can pass in a list of numbers to do multiple dumps.
+    called at the start of every run
     """
+    global suppressed
+    context.clear()
+    callers.clear()
+    last_dump_times.clear()
+    pending_dumps.clear()
+    suppressed = 0
+    histories.clear()
+
+
+def end_run(return_info: ReturnInfo):
+    """
+    dumps the last call of each dump with lastOnly and adds the sampling stats and the recorded history
+    to the result of the run. Called at the end of every run
+    """
+    global suppressed
+    for frame, variable, callerLine, count in pending_dumps.values():
+        # the last call is dumped now, so it was not suppressed
+        suppressed -= 1
+        variableDict = frame.f_locals if variable is _no_variable else {"dump output": variable}
+        send_dump(variableDict, frame.f_code.co_name, callerLine, count)
+    pending_dumps.clear()
+    return_info.dumpsSuppressed = suppressed
+
+    if histories:
+        return_info.variableHistory = pickle_object([history.flatten() for history in histories.values()])
+        histories.clear()
+
+
+def send_dump(variableDict: dict, caller: str, callerLine: int, count: int):
     startTime = time()
+    variableJson = pickle_user_vars(
+        variableDict,
+        get_settings().default_filter_vars,
+        get_settings().default_filter_types,
+        get_settings().expand_rows,
+    )
+    my_return_info = ReturnInfo(
+        "", variableJson, None, time() - startTime, None, caller, callerLine, done=False, count=count
+    )
 
-    callingFrame = inspect.currentframe().f_back
+    print_output(my_return_info)
+    # the user code may exit with os._exit or be killed right after, which would lose a queued dump
+    arepl_result_stream.drain()
+    return my_return_info
 
-    callerFile = callingFrame.f_code.co_filename
-    callerLine = callingFrame.f_lineno
-    caller = callingFrame.f_code.co_name
-    key = callerFile + caller + str(callerLine)
 
-    count = 0
+# the default of variable, as None is a value like any other
+_no_variable = object()
 
-    try:
-        count = context[key] + 1
-    except KeyError:
-        pass
 
+def dump(
+    variable: Any = _no_variable,
+    atCount: Union[int, List[int]] = 0,
+    every: int = None,
+    minIntervalMs: float = None,
+    lastOnly=False,
+    record=False,
+):
+    """
+    dumps specified var to arepl viewer or all vars of calling scope if unspecified
+    :param atCount: when to dump. ex: dump(,3) to dump vars at fourth iteration of loop. You can pass in a list of numbers to do multiple dumps.
+    The options below sample dumps in a loop instead, atCount is ignored if any of them is used:
+    :param every: dump every Nth call. ex: dump(i, every=1000)
+    :param minIntervalMs: dump at most once every X ms
+    :param lastOnly: only dump the last call, once the run is done.
+    Variables and objects changed after the call show their final state
+    :param record: record the value of variable at every call instead of dumping it. ex: dump(x, record=True)
+    The values are sent all at once when the run is done, see arepl_history
+    """
+    global suppressed
+    # dump is often called in loops, so calls that don't dump should be as cheap as possible.
+    # Hashing a code object or getting the line number of a frame takes longer than the rest of such a call
+    callingFrame = sys._getframe(1)
+    key = (id(callingFrame.f_code), callingFrame.f_lasti)
+    count = context.get(key, -1) + 1
     context[key] = count
+    if count == 0:
+        callers.append(callingFrame.f_code)
 
-    if count == atCount or (type(atCount) is list and count in atCount):
-        if variable is None:
-            variableDict = callingFrame.f_locals
-        else:
-            variableDict = {"dump output": variable}
-
-        variableJson = pickle_user_vars(
-            variableDict, get_settings().default_filter_vars, get_settings().default_filter_types
-        )
-        my_return_info = ReturnInfo(
-            "", variableJson, None, time() - startTime, None, caller, callerLine, done=False, count=count
-        )
+    if every is None and minIntervalMs is None and not lastOnly and not record:
+        if count != atCount and not (type(atCount) is list and count in atCount):
+            return None
+    else:
+        if every is not None and count % every != 0:
+            suppressed += 1
+            return None
+        if minIntervalMs is not None:
+            now = time()
+            lastDumpTime = last_dump_times.get(key)
+            if lastDumpTime is not None and now - lastDumpTime < minIntervalMs / 1000:
+                suppressed += 1
+                return None
+            last_dump_times[key] = now
+        if record:
+            if variable is _no_variable:
+                raise ValueError("dump needs a variable to record")
+            history = histories.get(key)
+            if history is None:
+                history = histories[key] = VariableHistory(callingFrame.f_code.co_name, callingFrame.f_lineno)
+            history.append(variable)
+            return None
+        if lastOnly:
+            suppressed += 1
+            # the locals are only read at the end of the run, copying them every call would be slow
+            pending_dumps[key] = (callingFrame, variable, callingFrame.f_lineno, count)
+            return None
 
-        print_output(my_return_info)
+    if variable is _no_variable:
+        variableDict = callingFrame.f_locals
+    else:
+        variableDict = {"dump output": variable}
 
-        # we don't need to return anything for user, this is just to make testing easier
-        return my_return_info
+    # we don't need to return anything for user, this is just to make testing easier
+    return send_dump(variableDict, callingFrame.f_code.co_name, callingFrame.f_lineno, count)
 
 
 # dump(5) for quick testing
@@ -0,0 +1,122 @@
+import json
+from traceback import FrameSummary, TracebackException
+
+#####################################
+"""
+Turns a TracebackException into the JSON of userError.
+jsonpickle would go over every attribute of the exception chain, which is slow and huge for deep tracebacks:
+a RecursionError has a thousand identical frames. So errors are serialized here instead, in the same shape:
+frames are a flat list, runs of identical frames are collapsed like python does when it prints a traceback
+("[Previous line repeated 996 more times]") and the number of frames and chained exceptions is bounded.
+Frames left out of a long stack are replaced by a single frame saying how many there were.
+"""
+#####################################
+
+# identical frames in a row that are kept, the last one kept has the number of frames collapsed into it
+REPEATED_FRAMES_KEPT = 3
+# frames kept of a traceback after collapsing, half from the start and half from the end
+MAX_FRAMES = 100
+# levels of __cause__, __context__ and exception groups
+MAX_CHAIN_DEPTH = 10
+# exceptions of an exception group
+MAX_GROUP_WIDTH = 15
+
+SYNTAX_ERROR_ATTRIBUTES = ["filename", "lineno", "end_lineno", "offset", "end_offset", "text", "msg"]
+
+
+def serialize_frame(frame: FrameSummary) -> dict:
+    return {
+        "filename": frame.filename,
+        "lineno": frame.lineno,
+        "end_lineno": getattr(frame, "end_lineno", None),
+        "colno": getattr(frame, "colno", None),
+        "end_colno": getattr(frame, "end_colno", None),
+        "name": frame.name,
+        "_line": frame.line,
+        "locals": None,
+    }
+
+
+def omitted_frames_marker(omitted: int) -> dict:
+    """
+    stands in for the frames left out of the middle of a long stack
+    """
+    return {
+        "filename": "",
+        "lineno": -1,
+        "end_lineno": None,
+        "colno": None,
+        "end_colno": None,
+        "name": f"[{omitted} frames omitted]",
+        "_line": "",
+        "locals": None,
+        "omitted": omitted,
+    }
+
+
+def collapse_frames(stack):
+    """
+    :returns: serialized frames without long runs of identical frames and with at most MAX_FRAMES frames
+        (plus a marker where frames were left out), and the number of frames left out of the middle
+    """
+    frames = []
+    previous = None
+    repeats = 0
+    for frame in stack:
+        current = (frame.filename, frame.lineno, frame.name)
+        if current == previous:
+            repeats += 1
+            if repeats >= REPEATED_FRAMES_KEPT:
+                frames[-1]["repeated"] = repeats - REPEATED_FRAMES_KEPT + 1
+                continue
+        else:
+            previous = current
+            repeats = 0
+        frames.append(serialize_frame(frame))
+
+    omitted = max(len(frames) - MAX_FRAMES, 0)
+    if omitted:
+        half = MAX_FRAMES // 2
+        frames = frames[:half] + [omitted_frames_marker(omitted)] + frames[-half:]
+    return frames, omitted
+
+
+def serialize_exception(exception: TracebackException, depth=0) -> dict:
+    if exception is None or depth > MAX_CHAIN_DEPTH:
+        return None
+
+    # python 3.13 deprecated exc_type
+    exc_type = getattr(exception, "_exc_type", None) or exception.exc_type
+    frames, frames_omitted = collapse_frames(exception.stack)
+    data = {
+        "py/object": "traceback.TracebackException",
+        "exc_type": {"py/type": f"{exc_type.__module__}.{exc_type.__qualname__}"} if exc_type else None,
+        "_str": exception._str,
+        "stack": {"py/seq": frames},
+        "framesOmitted": frames_omitted,
+        "__notes__": getattr(exception, "__notes__", None),
+        "__suppress_context__": exception.__suppress_context__,
+        "__cause__": serialize_exception(exception.__cause__, depth + 1),
+        "__context__": serialize_exception(exception.__context__, depth + 1),
+    }
+
+    group = getattr(exception, "exceptions", None)
+    data["exceptions"] = None
+    if group:
+        data["exceptions"] = [serialize_exception(e, depth + 1) for e in group[:MAX_GROUP_WIDTH]]
+
+    if exc_type is not None and issubclass(exc_type, SyntaxError):
+        for attribute in SYNTAX_ERROR_ATTRIBUTES:
+            data[attribute] = getattr(exception, attribute, None)
+    return data
+
+
+def serialize_error(exception: TracebackException) -> str:
+    """
+    :returns: the exception and its chain as JSON
+    """
+    data = serialize_exception(exception)
+    # cause and context are what jsonpickle called the first level of the chain
+    data["cause"] = data["__cause__"]
+    data["context"] = data["__context__"]
+    return json.dumps(data, ensure_ascii=False, default=str)
@@ -0,0 +1,109 @@
+from array import array
+from base64 import b64encode
+from copy import deepcopy
+
+import arepl_shared_memory
+
+#####################################
+"""
+Compact store for the values a dump records over a run, see dump(variable, record=True).
+Sending a result for every call of a dump in a loop would mean a JSON message per iteration,
+so the values are kept in columns and sent once, at the end of the run.
+Numbers go in a float64 array, which the frontend gets as a Float64Array.
+Once a value is not a number the column holds indexes into a list of the distinct values instead.
+Values that can change (lists, dicts, instances of classes, etc.) are deep copied when they are recorded,
+so each call shows the value as it was then. Values that can't be copied are kept by reference
+"""
+#####################################
+
+# bigger ints can't be stored exactly as floats
+MAX_EXACT_INT = 2**53
+# recorded as they are, equal values are stored once
+IMMUTABLE_TYPES = {int, float, complex, bool, str, bytes, type(None), tuple, frozenset, range}
+
+
+def encode_array(values: array) -> dict:
+    """
+    the frontend turns this into a typed array
+    """
+    data = {"py/array": values.typecode}
+    if arepl_shared_memory.available and values.itemsize * len(values) >= arepl_shared_memory.SIZE_THRESHOLD:
+        data["shm"] = arepl_shared_memory.write_block(values)
+    else:
+        data["values"] = b64encode(values.tobytes()).decode("ascii")
+    return data
+
+
+class VariableHistory:
+    def __init__(self, caller: str, lineno: int):
+        self.caller = caller
+        self.lineno = lineno
+        self.numbers = array("d")
+        # whether all numbers are ints
+        self.ints = True
+        # once a value is not a number: the index in objects of each value
+        self.refs = None
+        self.objects = []
+        self._object_indexes = {}
+
+    def append(self, value):
+        if self.refs is None:
+            value_type = type(value)
+            if value_type is float:
+                self.numbers.append(value)
+                self.ints = False
+                return
+            if value_type is int and -MAX_EXACT_INT <= value <= MAX_EXACT_INT:
+                self.numbers.append(value)
+                return
+            self._use_refs()
+        self.refs.append(self._object_index(value))
+
+    def _use_refs(self):
+        self.refs = array("I")
+        for number in self.numbers:
+            self.refs.append(self._object_index(int(number) if self.ints else number))
+        self.numbers = None
+
+    def _object_index(self, value) -> int:
+        value_type = type(value)
+        if value_type in IMMUTABLE_TYPES:
+            # the type is part of the key so 1, 1.0 and True stay distinct
+            key = (value_type, value)
+            try:
+                index = self._object_indexes.get(key)
+            except TypeError:
+                # a tuple or frozenset with something mutable in it
+                return self._add_snapshot(value)
+            if index is None:
+                index = len(self.objects)
+                self.objects.append(value)
+                self._object_indexes[key] = index
+            return index
+        return self._add_snapshot(value)
+
+    def _add_snapshot(self, value) -> int:
+        """
+        the value may change before the end of the run, so a copy of it is kept
+        """
+        try:
+            value = deepcopy(value)
+        except Exception:
+            pass
+        self.objects.append(value)
+        return len(self.objects) - 1
+
+    def flatten(self) -> dict:
+        """
+        :returns: the history in the form sent to the frontend
+        """
+        data = {"caller": self.caller, "lineno": self.lineno}
+        if self.refs is None:
+            data["count"] = len(self.numbers)
+            data["numbers"] = encode_array(self.numbers)
+            data["ints"] = self.ints
+        else:
+            data["count"] = len(self.refs)
+            data["refs"] = encode_array(self.refs)
+            data["objects"] = self.objects
+        return data
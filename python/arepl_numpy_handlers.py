@@ -0,0 +1,52 @@
+import numpy as np
+
+import arepl_jsonpickle as jsonpickle
+import arepl_jsonpickle.ext.numpy as jsonpickle_numpy
+import arepl_shared_memory
+
+#####################################
+"""
+Numpy handlers for AREPL. These build on top of the jsonpickle numpy extension.
+Big arrays are sent as raw bytes so the frontend can turn them straight into typed arrays,
+that way numbers never round-trip through decimal text.
+Really big arrays skip the result pipe entirely and go through shared memory, see arepl_shared_memory
+"""
+#####################################
+
+# arrays with more elements than this are sent as binary instead of nested lists
+BINARY_SIZE_THRESHOLD = 16
+
+
+class NDArrayBinaryHandler(jsonpickle_numpy.NumpyNDArrayHandlerBinary):
+    """
+    Same as the jsonpickle binary handler, except:
+    views and fortran-ordered arrays are sent as C-ordered copies so the frontend only needs the shape,
+    the compression is written out so the frontend knows how to decode the buffer,
+    and arrays of SIZE_THRESHOLD bytes or more are put in shared memory when possible
+    """
+
+    def flatten(self, obj, data):
+        if not obj.flags.c_contiguous:
+            obj = np.ascontiguousarray(obj)
+        if arepl_shared_memory.available and obj.nbytes >= arepl_shared_memory.SIZE_THRESHOLD and obj.dtype != object:
+            return self.flatten_shared(obj, data)
+        data = super().flatten(obj, data)
+        if self.compression and isinstance(data.get("values"), str):
+            data["compression"] = self.compression.__name__
+        return data
+
+    def flatten_shared(self, obj, data):
+        data["shm"] = arepl_shared_memory.write_block(obj.reshape(-1).view(np.uint8))
+        data["shape"] = obj.shape
+        self.flatten_dtype(obj.dtype.newbyteorder("N"), data)
+        self.flatten_byteorder(obj, data)
+        return data
+
+
+def register_handlers(size_threshold=BINARY_SIZE_THRESHOLD, compression=None):
+    """
+    :param size_threshold: arrays with more elements than this are sent as binary
+    :param compression: a compression module (like zlib) or None
+    """
+    jsonpickle_numpy.register_handlers()
+    jsonpickle.handlers.register(np.ndarray, NDArrayBinaryHandler(size_threshold, compression), base=True)
@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+
+import arepl_jsonpickle as jsonpickle
+import arepl_jsonpickle.ext.pandas as jsonpickle_pandas
+import arepl_numpy_handlers
+
+#####################################
+"""
+Pandas handlers for AREPL. These build on top of the jsonpickle pandas extension.
+Pickling every cell of a big dataframe is slow and nobody is going to read a million rows anyways,
+so big objects are sent as a preview: shape, dtypes, head/tail rows, a describe() summary and null counts.
+The full data of a range of rows can be requested through the expand_rows setting, see RowPage
+When the full data of a dataframe is sent numeric columns are sent as binary blocks, see PandasDfHandler
+"""
+#####################################
+
+# objects with more rows than this are sent as a preview
+PREVIEW_ROW_THRESHOLD = 1000
+# number of rows to show at the start and at the end of a preview
+PREVIEW_ROWS = 5
+
+
+class PreviewHandler:
+    """
+    mixin for sending a preview of big objects instead of the full data.
+    Put it before the jsonpickle handler in the bases so flatten_full falls back to the jsonpickle flatten
+    """
+
+    def flatten(self, obj, data):
+        if len(obj) <= PREVIEW_ROW_THRESHOLD:
+            return self.flatten_full(obj, data)
+        data["preview"] = True
+        data["shape"] = obj.shape
+        return self.flatten_preview(obj, data)
+
+    def flatten_full(self, obj, data):
+        return super().flatten(obj, data)
+
+    def flatten_preview(self, obj, data):
+        raise NotImplementedError
+
+    def flatten_describe(self, obj):
+        try:
+            return self.context.flatten(obj.describe(), reset=False)
+        except Exception:
+            # describe fails on some dtypes, the rest of the preview is still useful
+            return None
+
+
+def is_buffer_dtype(dtype) -> bool:
+    """whether values of this dtype can be sent as a contiguous buffer"""
+    return isinstance(dtype, np.dtype) and (
+        pd.api.types.is_numeric_dtype(dtype)
+        or pd.api.types.is_datetime64_dtype(dtype)
+        or pd.api.types.is_timedelta64_dtype(dtype)
+    )
+
+
+# what object columns holding only these kinds of values (see pd.api.types.infer_dtype) can be sent as.
+# Not "mixed-integer-float", as float64 would round ints above 2**53
+INFERRED_BUFFER_DTYPES = {
+    "integer": np.dtype(np.int64),
+    "floating": np.dtype(np.float64),
+    "boolean": np.dtype(np.bool_),
+}
+
+
+class PandasDfHandler(PreviewHandler, jsonpickle_pandas.PandasDfHandler):
+    """
+    The full data is sent as blocks of columns.
+    Columns that can be stored as a contiguous buffer are grouped by dtype into a 2d array
+    (one row per column) which goes through the numpy handler, so it is sent as binary.
+    The other columns are sent as lists.
+    Which kind of column is decided with pd.api.types so we never have to look at each cell
+    """
+
+    def flatten_full(self, obj, data):
+        buffer_positions = {}
+        list_positions = []
+        for position, (_, col) in enumerate(obj.items()):
+            dtype = col.dtype
+            if pd.api.types.is_object_dtype(dtype):
+                dtype = INFERRED_BUFFER_DTYPES.get(pd.api.types.infer_dtype(col, skipna=False))
+            if dtype is not None and is_buffer_dtype(dtype):
+                buffer_positions.setdefault(dtype, []).append(position)
+            else:
+                list_positions.append(position)
+
+        blocks = []
+        for dtype, positions in buffer_positions.items():
+            try:
+                values = obj.iloc[:, positions].to_numpy(dtype=dtype).T
+            except (OverflowError, TypeError, ValueError):
+                # ex: python ints too big for int64
+                list_positions.extend(positions)
+                continue
+            if dtype.kind in "mM":
+                # datetimes and timedeltas are sent as their underlying int64 so they are never turned into text
+                values = values.view(np.int64)
+            blocks.append(
+                {"dtype": str(dtype), "columns": positions, "values": self.context.flatten(values, reset=False)}
+            )
+        if list_positions:
+            list_positions.sort()
+            values = [obj.iloc[:, position].tolist() for position in list_positions]
+            blocks.append(
+                {"dtype": "object", "columns": list_positions, "values": self.context.flatten(values, reset=False)}
+            )
+
+        data["columns"] = self.context.flatten(obj.columns.tolist(), reset=False)
+        data["column_names"] = self.context.flatten(list(obj.columns.names), reset=False)
+        data["dtypes"] = obj.dtypes.astype(str).tolist()
+        data["index"] = flatten_index(self.context, obj.index)
+        data["blocks"] = blocks
+        return data
+
+    def restore(self, data):
+        if "blocks" not in data:
+            # preview or an older format
+            return super().restore(data)
+
+        columns = self.context.restore(data["columns"], reset=False)
+        column_values = [None] * len(columns)
+        for block in data["blocks"]:
+            values = self.context.restore(block["values"], reset=False)
+            if block["dtype"] != "object":
+                values = np.asarray(values).view(block["dtype"])
+            for position, col_values in zip(block["columns"], values):
+                column_values[position] = pd.Series(col_values, dtype=block["dtype"])
+
+        index = restore_index(self.context, data["index"])
+        df = pd.concat(column_values, axis=1) if column_values else pd.DataFrame(index=range(len(index)))
+        df.index = index
+        column_names = data.get("column_names", [None])
+        if len(column_names) > 1:
+            df.columns = pd.MultiIndex.from_tuples(columns, names=column_names)
+        else:
+            df.columns = pd.Index(columns, name=column_names[0])
+        for col, dtype in zip(df.columns, data["dtypes"]):
+            if str(df[col].dtype) != dtype:
+                df[col] = df[col].astype(dtype)
+        return df
+
+    def flatten_preview(self, obj, data):
+        data["columns"] = self.context.flatten(obj.columns.tolist(), reset=False)
+        data["dtypes"] = obj.dtypes.astype(str).tolist()
+        data["null_counts"] = obj.isna().sum().tolist()
+        data["head"] = self.context.flatten(obj.head(PREVIEW_ROWS), reset=False)
+        data["tail"] = self.context.flatten(obj.tail(PREVIEW_ROWS), reset=False)
+        data["describe"] = self.flatten_describe(obj)
+        return data
+
+
+def flatten_index(context, index):
+    if isinstance(index, pd.RangeIndex):
+        return {"start": index.start, "stop": index.stop, "step": index.step, "name": index.name}
+    if is_buffer_dtype(index.dtype):
+        return {"values": context.flatten(index.to_numpy(), reset=False), "name": index.name}
+    return {
+        "values": context.flatten(index.tolist(), reset=False),
+        "dtype": str(index.dtype),
+        "names": context.flatten(list(index.names), reset=False),
+    }
+
+
+def restore_index(context, data):
+    if "start" in data:
+        return pd.RangeIndex(data["start"], data["stop"], data["step"], name=data["name"])
+    values = context.restore(data["values"], reset=False)
+    if "names" not in data:
+        return pd.Index(values, name=data["name"])
+    if len(data["names"]) > 1:
+        return pd.MultiIndex.from_tuples(values, names=data["names"])
+    return pd.Index(values, dtype=data["dtype"], name=data["names"][0])
+
+
+class PandasSeriesHandler(PreviewHandler, jsonpickle_pandas.PandasSeriesHandler):
+    def flatten_preview(self, obj, data):
+        data["name"] = self.context.flatten(obj.name, reset=False)
+        data["dtype"] = str(obj.dtype)
+        data["null_count"] = int(obj.isna().sum())
+        data["head"] = self.context.flatten(obj.head(PREVIEW_ROWS), reset=False)
+        data["tail"] = self.context.flatten(obj.tail(PREVIEW_ROWS), reset=False)
+        data["describe"] = self.flatten_describe(obj)
+        return data
+
+
+class PandasIndexHandler(PreviewHandler, jsonpickle_pandas.PandasIndexHandler):
+    def flatten_preview(self, obj, data):
+        data.update(self.context.flatten(self.name_bundler(obj), reset=False))
+        data["dtype"] = str(obj.dtype)
+        data["null_count"] = self.null_count(obj)
+        data["head"] = self.context.flatten(obj[:PREVIEW_ROWS].tolist(), reset=False)
+        data["tail"] = self.context.flatten(obj[-PREVIEW_ROWS:].tolist(), reset=False)
+        return data
+
+    def null_count(self, obj):
+        return int(obj.isna().sum())
+
+
+class PandasPeriodIndexHandler(PandasIndexHandler, jsonpickle_pandas.PandasPeriodIndexHandler):
+    pass
+
+
+class PandasMultiIndexHandler(PandasIndexHandler, jsonpickle_pandas.PandasMultiIndexHandler):
+    def null_count(self, obj):
+        # isna is not defined for MultiIndex, a null in any level is stored as a code of -1
+        return int((np.array(obj.codes) == -1).any(axis=0).sum())
+
+
+def register_handlers():
+    jsonpickle_pandas.register_handlers()
+    # jsonpickle_pandas registers the default jsonpickle numpy handlers, so we put ours back
+    arepl_numpy_handlers.register_handlers()
+    jsonpickle.handlers.register(pd.DataFrame, PandasDfHandler, base=True)
+    jsonpickle.handlers.register(pd.Series, PandasSeriesHandler, base=True)
+    jsonpickle.handlers.register(pd.Index, PandasIndexHandler, base=True)
+    jsonpickle.handlers.register(pd.PeriodIndex, PandasPeriodIndexHandler, base=True)
+    jsonpickle.handlers.register(pd.MultiIndex, PandasMultiIndexHandler, base=True)
@@ -1,11 +1,12 @@
-from importlib import (
-    util,
-)  # https://stackoverflow.com/questions/39660934/error-when-using-importlib-util-to-check-for-library
 from math import isnan
-from typing import Any, Dict, List
+import sys
+from typing import Any, Dict, List, Sequence
 
 import arepl_jsonpickle as jsonpickle
-from arepl_custom_handlers import handlers
+import arepl_error_serializer
+import arepl_shared_memory
+from arepl_custom_handlers import handlers, RowPage
+from arepl_var_filter import get_filter
 
 #####################################
 """
@@ -17,7 +18,8 @@ This file sets up jsonpickle. Jsonpickle is used in pickle_user_vars for picking
 class CustomPickler(jsonpickle.pickler.Pickler):
     """
     encodes float values like inf / nan as strings to follow JSON spec while keeping meaning
-    I'm doing this in custom class because handlers do not fire for floats
+    and puts big byte blobs in shared memory
+    I'm doing this in custom class because handlers do not fire for floats or bytes
     """
 
     inf = float("inf")
@@ -31,26 +33,79 @@ class CustomPickler(jsonpickle.pickler.Pickler):
                 return "-Infinity"
             if isnan(obj):
                 return "NaN"
+        elif (
+            (type(obj) is bytes or type(obj) is bytearray)
+            and len(obj) >= arepl_shared_memory.SIZE_THRESHOLD
+            and arepl_shared_memory.available
+        ):
+            return {"py/shm": arepl_shared_memory.write_block(obj)}
         return super(CustomPickler, self)._flatten(obj)
 
 
-if util.find_spec("numpy") is not None:
-    try:
-        import arepl_jsonpickle.ext.numpy as jsonpickle_numpy
+def _register_pandas_handlers():
+    import arepl_pandas_handlers
 
-        jsonpickle_numpy.register_handlers()
-    except ImportError:
-        # todo: log ImportError
-        pass
+    arepl_pandas_handlers.register_handlers()
 
-if util.find_spec("pandas") is not None:
-    try:
-        import arepl_jsonpickle.ext.pandas as jsonpickle_pandas
 
-        jsonpickle_pandas.register_handlers()
-    except ImportError:
-        # todo: log ImportError
-        pass
+def _register_numpy_handlers():
+    import arepl_numpy_handlers
+
+    arepl_numpy_handlers.register_handlers()
+
+
+def _register_arrow_handlers():
+    import arepl_arrow_handlers
+
+    arepl_arrow_handlers.register_handlers()
+
+
+def _register_arrow_pandas_handlers():
+    import arepl_arrow_pandas_handlers
+
+    arepl_arrow_pandas_handlers.register_handlers()
+
+
+def _register_polars_handlers():
+    import arepl_arrow_handlers
+
+    arepl_arrow_handlers.register_polars_handlers()
+
+
+# Importing numpy / pandas / pyarrow takes hundreds of ms, which would slow down every evaluator start.
+# So handlers for a library are only registered once the user has imported it -
+# the user can't have objects from a library they never imported.
+# (modules that need to be imported, function registering the handlers)
+# Order matters: a registration replaces earlier handlers for the same type
+_lazy_handlers = [
+    (("pandas",), _register_pandas_handlers),
+    (("numpy",), _register_numpy_handlers),
+    (("pyarrow",), _register_arrow_handlers),
+    # replaces the pandas dataframe handler
+    (("pandas", "pyarrow"), _register_arrow_pandas_handlers),
+    # polars needs pyarrow to convert dataframes to arrow, but does not import it
+    (("polars",), _register_polars_handlers),
+]
+
+
+def register_lazy_handlers():
+    """registers the handlers of libraries that have been imported since the last call"""
+    global _lazy_handlers
+    if not _lazy_handlers:
+        return
+
+    pending = []
+    for modules, register in _lazy_handlers:
+        if all(module in sys.modules for module in modules):
+            try:
+                register()
+            except ImportError:
+                # todo: log ImportError
+                pass
+        else:
+            pending.append((modules, register))
+    _lazy_handlers = pending
+
 
 jsonpickle.pickler.Pickler = CustomPickler
 jsonpickle.set_encoder_options("json", ensure_ascii=False)
@@ -58,37 +113,33 @@ jsonpickle.set_encoder_options("json", allow_nan=False)  # nan is not deseriazab
 for handler in handlers:
     jsonpickle.handlers.register(handler["type"], handler["handler"])
 
-specialVars = ["__doc__", "__file__", "__loader__", "__name__", "__package__", "__spec__"]
-
 
 def pickle_user_vars(
     userVars: Dict[str, Any],
-    default_filter_vars: List[str] = [],
-    default_filter_types: List[str] = ["<class 'module'>", "<class 'function'>"],
+    default_filter_vars: Sequence[str] = (),
+    default_filter_types: Sequence[str] = ("<class 'module'>", "<class 'function'>"),
+    expand_rows: Dict[str, List[int]] = {},
 ):
-    default_filter_vars += userVars.get("arepl_filter", [])
-    default_filter_types += userVars.get("arepl_filter_type", [])
-    custom_filter_function = userVars.get("arepl_filter_function", lambda x: x)
+    """
+    :param expand_rows: rows to send in full for variables that would otherwise be sent as a preview.
+        ex: {"df": [1000, 2000]} sends rows 1000 to 2000 of df
+    """
+    register_lazy_handlers()
 
     # filter out non-user vars, no point in showing them
-    userVariables = {
-        k: v
-        for k, v in userVars.items()
-        if str(type(v)) not in default_filter_types
-        and k not in specialVars + ["__builtins__"]
-        and k not in default_filter_vars
-    }
-
-    # These vars are just for filtering, no need to show to user
-    userVariables.pop("arepl_filter", None)
-    userVariables.pop("arepl_filter_type", None)
-    userVariables.pop("arepl_filter_function", None)
+    userVariables = get_filter(default_filter_vars, default_filter_types, userVars).filter(userVars)
 
     # but we do want to show arepl_store if it has data
     if userVars.get("arepl_store") is not None:
         userVariables["arepl_store"] = userVars["arepl_store"]
 
-    userVariables = custom_filter_function(userVariables)
+    custom_filter_function = userVars.get("arepl_filter_function")
+    if custom_filter_function is not None:
+        userVariables = custom_filter_function(userVariables)
+
+    for name, (start, stop) in expand_rows.items():
+        if name in userVariables:
+            userVariables[name] = RowPage(userVariables[name], start, stop)
 
     # json dumps cant handle any object type, so we need to use jsonpickle
     # still has limitations but can handle much more
@@ -100,18 +151,18 @@ def pickle_user_vars(
     )
 
 
+def pickle_object(obj):
+    """
+    pickles something other than user variables, like the variable history of dumps
+    """
+    register_lazy_handlers()
+    return jsonpickle.encode(
+        obj, max_depth=100, fail_safe=lambda x: "AREPL could not pickle this object", make_refs=False
+    )
+
+
 def pickle_user_error(error):
-    # error needs to have context/cause
-    # as a actual attribute so it gets pickled
-    originalError = error
-    while error:
-        if error.__context__:
-            error.context = error.__context__
-            error = error.__context__
-        if error.__cause__:
-            error.cause = error.__cause__
-            error = error.__cause__
-        if error.__cause__ is None and error.__context__ is None:
-            break
-
-    return jsonpickle.encode(originalError, fail_safe=lambda x: "AREPL could not pickle this object")
+    """
+    :param error: TracebackException of the user error
+    """
+    return arepl_error_serializer.serialize_error(error)
@@ -1,14 +1,21 @@
+from time import time
+
+# startup is timed so we can keep track of how long it takes for the evaluator to start, see startupTimes
+imports_start = time()
+
 from importlib import (
     util,
 )  # https://stackoverflow.com/questions/39660934/error-when-using-importlib-util-to-check-for-library
+from dis import findlinestarts
+from hashlib import sha1
 import json
+import marshal
 import traceback
-from time import time
-from io import TextIOWrapper
 import os
 import sys
 from sys import path, argv, exc_info
 from contextlib import contextmanager
+from types import CodeType
 
 # do NOT use from arepl_overloads import arepl_input_iterator
 # it will recreate arepl_input_iterator and we need the original
@@ -18,9 +25,17 @@ from arepl_custom_locals import get_normal_starting_locals, inject_overloads
 from arepl_settings import get_settings, update_settings
 from arepl_user_error import UserError
 import arepl_result_stream
+import arepl_shared_memory
+import arepl_soft_reset
+import arepl_stdout
+import arepl_subinterpreter
+
+imports_time = time() - imports_start
 
+howdoi_start = time()
 if util.find_spec("howdoi") is not None:
     from howdoi import howdoi  # pylint: disable=import-error
+howdoi_time = time() - howdoi_start
 
 #####################################
 """
@@ -46,10 +61,32 @@ class ReturnInfo:
         done=True,
         count=-1,
         startResult=False,
+        startupTimes: dict = None,
+        softResettable=False,
+        astHash: str = None,
+        astLines: list = None,
+        astUnchanged=False,
+        outputTruncated: dict = None,
+        dumpsSuppressed=0,
+        variableHistory: str = None,
+        resultStreamStats: dict = None,
+        varsPending=False,
+        subinterpreterUnsupported=False,
     ):
         """
         :param userVariables: JSON string
         :param count: iteration number, used when dumping info at a specific point.
+        :param startupTimes: seconds taken by each phase of starting the evaluator. Only set on the start result
+        :param softResettable: whether the evaluator can be soft reset after this run instead of restarted
+        :param astHash: hash of the code that ignores comments and formatting, see get_ast_info
+        :param astLines: line of each statement of the code, to map line numbers between runs with the same astHash
+        :param astUnchanged: the code was not ran because it has the same astHash as the last run
+        :param outputTruncated: bytes and lines of output that were dropped because of max_output_kb, if any
+        :param dumpsSuppressed: calls of dump that were not dumped because of its every, minIntervalMs or lastOnly options
+        :param variableHistory: JSON string of the values recorded by dump(variable, record=True), see arepl_history
+        :param resultStreamStats: how the results of the run were written, see arepl_result_stream.ResultWriter
+        :param varsPending: sent when the code raised, before the variables are pickled. The final result has the variables
+        :param subinterpreterUnsupported: the code was ran in a subinterpreter first, but had to be ran again in the evaluator
         """
         self.userError = userError
         self.userVariables = userVariables
@@ -61,16 +98,44 @@ class ReturnInfo:
         self.done = done
         self.count = count
         self.startResult = startResult
+        self.startupTimes = startupTimes
+        self.softResettable = softResettable
+        self.astHash = astHash
+        self.astLines = astLines
+        self.astUnchanged = astUnchanged
+        self.outputTruncated = outputTruncated
+        self.dumpsSuppressed = dumpsSuppressed
+        self.variableHistory = variableHistory
+        self.resultStreamStats = resultStreamStats
+        self.varsPending = varsPending
+        self.subinterpreterUnsupported = subinterpreterUnsupported
 
 
 class ExecArgs(object):
     # HALT! do NOT change this without changing corresponding type in the frontend! <----
     # Also note that this uses camelCase because that is standard in JS frontend
-    def __init__(self, evalCode: str, savedCode="", filePath="", usePreviousVariables=False, *args, **kwargs):
+    def __init__(
+        self,
+        evalCode: str,
+        savedCode="",
+        filePath="",
+        usePreviousVariables=False,
+        previousAstHash: str = None,
+        skipUnchangedAst=False,
+        *args,
+        **kwargs,
+    ):
+        """
+        :param previousAstHash: astHash of the last run. If the code has the same hash it is not ran
+        :param skipUnchangedAst: don't run code with the previousAstHash. Off by default, as the output can change
+            even if the code didn't, ex: if the code uses random or reads a file or module that was edited
+        """
         self.savedCode = savedCode
         self.evalCode = evalCode
         self.filePath = filePath
         self.usePreviousVariables = usePreviousVariables
+        self.previousAstHash = previousAstHash
+        self.skipUnchangedAst = skipUnchangedAst
         # HALT! do NOT change this without changing corresponding type in the frontend! <----
 
 
@@ -114,6 +179,9 @@ noGlobalVarsMsg = {"zz status": "AREPL is configured to not show global vars"}
 
 exec_locals = None
 
+# (source, code object) of the last syntax check, so the run that usually follows it doesn't compile again
+compiled_code = (None, None)
+
 
 def exec_input(exec_args: ExecArgs):
     """
@@ -122,9 +190,28 @@ def exec_input(exec_args: ExecArgs):
     """
     global exec_locals
 
+    code = exec_args.evalCode
+    ast_hash, ast_lines = None, None
+    try:
+        code = get_code(exec_args.evalCode)
+    except (SyntaxError, ValueError):
+        # exec raises the error again, as a user error
+        pass
+    else:
+        # previous variables can change the result of the same code
+        if exec_args.skipUnchangedAst and not exec_args.usePreviousVariables:
+            ast_hash, ast_lines = get_ast_info(code, exec_args.filePath)
+            if ast_hash == exec_args.previousAstHash:
+                return ReturnInfo("", "{}", 0, None, astHash=ast_hash, astLines=ast_lines, astUnchanged=True)
+
     # see https://docs.python.org/3/library/sys.html#sys.argv
     argv[0] = exec_args.filePath
 
+    # dump counts its calls per run
+    arepl_dump = sys.modules.get("arepl_dump")
+    if arepl_dump is not None:
+        arepl_dump.reset()
+
     first_run = exec_locals == None
     if first_run or not exec_args.usePreviousVariables:
         # We have to set this on first run.
@@ -132,10 +219,15 @@ def exec_input(exec_args: ExecArgs):
         exec_locals = get_normal_starting_locals(exec_args.filePath)
         inject_overloads(exec_locals)
 
+    # the user may replace sys.stdout, so we keep a reference to turn flushing off again
+    stdout = sys.stdout
+    if isinstance(stdout, arepl_stdout.CoalescingStdout):
+        stdout.start_flushing()
+
     with script_path(os.path.dirname(exec_args.filePath)):
         try:
             start = time()
-            exec(exec_args.evalCode, exec_locals)
+            exec(code, exec_locals)
             execTime = time() - start
         except BaseException:
             execTime = time() - start
@@ -148,6 +240,8 @@ def exec_input(exec_args: ExecArgs):
             if sys.stdout.flush and callable(sys.stdout.flush):
                 # a normal program will flush at the end of the run
                 sys.stdout.flush()
+            if isinstance(stdout, arepl_stdout.CoalescingStdout):
+                stdout.stop_flushing()
 
             # clear mock stdin for next run
             arepl_overloads.arepl_input_iterator = None
@@ -157,6 +251,7 @@ def exec_input(exec_args: ExecArgs):
             exec_locals,
             get_settings().default_filter_vars,
             get_settings().default_filter_types,
+            get_settings().expand_rows,
         )
     else:
         userVariables = pickle_user_vars(
@@ -165,28 +260,133 @@ def exec_input(exec_args: ExecArgs):
             get_settings().default_filter_types,
         )
 
-    return ReturnInfo("", userVariables, execTime, None)
+    return ReturnInfo("", userVariables, execTime, None, astHash=ast_hash, astLines=ast_lines)
+
+
+def strip_lines(code: CodeType) -> CodeType:
+    """
+    returns the code without line and column info, which is all that changes when comments or formatting are edited
+    """
+    consts = tuple(strip_lines(const) if isinstance(const, CodeType) else const for const in code.co_consts)
+    line_table = "co_linetable" if sys.version_info >= (3, 10) else "co_lnotab"
+    return code.replace(co_consts=consts, co_firstlineno=1, **{line_table: b""})
+
+
+def get_code_lines(code: CodeType, lines: set):
+    # python 3.11+ puts instructions that don't come from the source at line 0
+    lines.update(line for _, line in findlinestarts(code) if line)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            get_code_lines(const, lines)
+    return lines
+
+
+def get_ast_info(code: CodeType, file_path: str):
+    """
+    Editing a comment or the formatting of code doesn't change what it does, so it doesn't need to be ran again.
+    The bytecode is compiled from the AST, so once line info is stripped from it it's a normalized form of the AST.
+    This is faster than hashing the AST itself, as the code has to be compiled anyways
+    :returns: a hash of the code that ignores comments and formatting,
+        and the sorted lines that have code, so results of code with the same hash can be mapped to the new lines
+    """
+    # marshal version 2 does not write references, which depend on refcounts
+    # The file path is included as the code can depend on it
+    ast_hash = sha1(file_path.encode() + b"\n" + marshal.dumps(strip_lines(code), 2)).hexdigest()
+    return ast_hash, sorted(get_code_lines(code, set()))
+
+
+def get_startup_times(result_stream_time: float):
+    """
+    seconds taken by each phase of starting the evaluator
+    """
+    startup_times = {"imports": imports_time, "howdoi": howdoi_time, "resultStream": result_stream_time}
+    # node passes the time it spawned the process, in ms since epoch
+    spawn_time = os.environ.get("AREPL_SPAWN_TIME")
+    if spawn_time:
+        startup_times["interpreter"] = imports_start - int(spawn_time) / 1000
+    return startup_times
+
+
+def get_code(source: str) -> CodeType:
+    """
+    returns the code compiled by the last syntax check if it was for the same source, otherwise compiles it
+    """
+    global compiled_code
+    cached_source, code = compiled_code
+    compiled_code = (None, None)
+    if cached_source == source:
+        return code
+    # same filename as exec would use
+    return compile(source, "<string>", "exec")
+
+
+def check_syntax(source: str):
+    """
+    compiles the source without running it and sends back any SyntaxError
+    """
+    global compiled_code
+    syntax_error = None
+    try:
+        compiled_code = (source, compile(source, "<string>", "exec"))
+    except (SyntaxError, ValueError) as e:
+        compiled_code = (None, None)
+        syntax_error = {
+            "msg": getattr(e, "msg", str(e)),
+            "lineno": getattr(e, "lineno", None),
+            "offset": getattr(e, "offset", None),
+            "endLineno": getattr(e, "end_lineno", None),
+            "endOffset": getattr(e, "end_offset", None),
+            "text": getattr(e, "text", None),
+            "formatted": "".join(traceback.format_exception_only(type(e), e)),
+        }
+
+    result = {"syntaxCheck": True, "syntaxError": syntax_error}
+    print_output(result)
+    return result
 
 
 def print_output(output: ReturnInfo):
     """
     turns output into JSON and sends it to result stream
     """
+    # output printed before the result should reach node before it
+    # (user code may have replaced stdout with anything)
+    flush = getattr(sys.stdout, "flush", None)
+    if callable(flush):
+        flush()
     # We use result stream because user might use stdout and we don't want to conflict
-    print(
-        json.dumps(output, default=lambda x: x.__dict__),
-        file=arepl_result_stream.get_result_stream(),
-        flush=True,
-    )
+    arepl_result_stream.write_result(json.dumps(output, default=lambda x: x.__dict__))
 
 
-def main(json_input: str):
-    data = json.loads(json_input)
+def soft_reset():
+    """
+    rolls back the changes of the last run so the evaluator is like it was freshly started
+    """
+    global exec_locals
+    start = time()
+    arepl_soft_reset.soft_reset()
+    exec_locals = None
+
+    return_info = ReturnInfo("", {}, 0, 0, startResult=True, startupTimes={"softReset": time() - start})
+    print_output(return_info)
+    return return_info
+
+
+def run(data: dict):
+    """
+    runs the code and returns info about it, including any error
+    :rtype: returnInfo
+    """
     execArgs = ExecArgs(**data)
     update_settings(data)
 
     start = time()
     return_info = ReturnInfo("", "{}", None, None)
+    # the user may replace sys.stdout
+    stdout = sys.stdout
+    limit_output = isinstance(stdout, arepl_stdout.LimitedStdout)
+    if limit_output:
+        stdout.limit_output(get_settings().max_output_kb * 1024)
 
     try:
         return_info = exec_input(execArgs)
@@ -195,14 +395,72 @@ def main(json_input: str):
     except UserError as e:
         return_info.userError = pickle_user_error(e.traceback_exception)
         return_info.userErrorMsg = e.friendly_message
-        return_info.userVariables = e.varsSoFar
         return_info.execTime = e.execTime
+        # in a subinterpreter an unsupported module means the code is ran again in the evaluator, which shows the error
+        if (
+            get_settings().error_vars != "none"
+            and arepl_subinterpreter.UNSUPPORTED_MODULE_MESSAGE not in e.friendly_message
+        ):
+            # pickling the variables can take a while, so the error is shown right away
+            error_info = ReturnInfo(
+                return_info.userError, "{}", e.execTime, time() - start, done=False, varsPending=True
+            )
+            error_info.userErrorMsg = e.friendly_message
+            print_output(error_info)
+        return_info.userVariables = e.varsSoFar
     except Exception:
         return_info.internalError = "Sorry, AREPL has ran into an error\n\n" + traceback.format_exc()
 
+    # dumps of the last call are sent after the run, before its result, which gets the recorded history
+    arepl_dump = sys.modules.get("arepl_dump")
+    if arepl_dump is not None and not return_info.astUnchanged:
+        try:
+            arepl_dump.end_run(return_info)
+        except Exception:
+            return_info.internalError = "Sorry, AREPL has ran into an error\n\n" + traceback.format_exc()
+
+    if limit_output:
+        return_info.outputTruncated = stdout.end_output_limit()
     return_info.totalPyTime = time() - start
+    return return_info
+
+
+def main(json_input: str):
+    data = json.loads(json_input)
+    if data.get("softReset"):
+        return soft_reset()
+    if data.get("compileOnly"):
+        return check_syntax(data["evalCode"])
+
+    # results of the last run have been delivered, so their shared memory is no longer needed
+    arepl_shared_memory.release_blocks()
+    arepl_result_stream.reset_stats()
+
+    return_info = None
+    # previous variables live in this interpreter, so they can't be used from a subinterpreter
+    use_subinterpreter = (
+        data.get("use_subinterpreters") and arepl_subinterpreter.available and not data.get("usePreviousVariables")
+    )
+    if use_subinterpreter:
+        return_info, shown_output = arepl_subinterpreter.run(json_input)
+        if return_info is None and isinstance(sys.stdout, arepl_stdout.LimitedStdout):
+            sys.stdout.skip_output(shown_output)
+    if return_info is None:
+        return_info = run(data)
+        return_info.subinterpreterUnsupported = bool(use_subinterpreter)
+
+    return_info.softResettable = arepl_soft_reset.can_soft_reset()
+    # the results of the run are written before its final result, which has the stats of writing them
+    arepl_result_stream.drain()
+    return_info.resultStreamStats = arepl_result_stream.get_stats()
 
     print_output(return_info)
+    if use_subinterpreter and not return_info.subinterpreterUnsupported:
+        try:
+            arepl_subinterpreter.prepare()
+        except arepl_subinterpreter.interpreters.ExecutionFailed:
+            # the next run tries again
+            pass
     return return_info
 
 
@@ -215,14 +473,18 @@ if __name__ == "__main__":
     if sys.platform == "win32":
         encoding = "utf8"
     # arepl is ran via node so python thinks stdout is not a tty device and uses full buffering
-    # We want users to see output in real time so we change to line buffering
-    # todo: once python3.7 is supported use .reconfigure() instead
-    sys.stdout = TextIOWrapper(open(sys.stdout.fileno(), "wb"), line_buffering=True, encoding=encoding)
+    # We want users to see output in real time, without a write for every line of print-heavy code
+    sys.stdout = arepl_stdout.CoalescingStdout(sys.stdout.fileno(), encoding=encoding)
     # Arepl node code will spawn process with a extra pipe for results
     # This is to avoid results conflicting with user writes to stdout
+    result_stream_start = time()
     arepl_result_stream.open_result_stream()
+    arepl_result_stream.start_writer()
+    result_stream_time = time() - result_stream_start
 
-    finished_starting = ReturnInfo("", {}, 0, 0, startResult=True)
+    # soft resets roll back to the state AREPL is in once it has started
+    arepl_soft_reset.take_snapshot()
+    finished_starting = ReturnInfo("", {}, 0, 0, startResult=True, startupTimes=get_startup_times(result_stream_time))
     print_output(finished_starting)
 
     while True:
@@ -1,15 +1,135 @@
 """
 File for storing result stream so it can be accessed by dump.
 Once you close a stream you can't reopen, hence why this file just has a open method
+
+Once start_writer has been called results are written by a single thread, fed by a queue.
+That way results are never interleaved when user threads dump at the same time,
+user code doesn't wait on the pipe to node unless the queue is full, and small results are written in batches.
+dump is the exception, it waits until its result is written, so a dump is never lost if the process ends abruptly.
+Otherwise (in subinterpreters and tests) results are written right away
 """
 
+from queue import Queue
+from threading import Lock, Thread
+from time import time
+
+# the writer writes queued results together, up to this many characters
+BATCH_SIZE = 64 * 1024
+# results that can be queued before write_result blocks
+MAX_QUEUED = 1024
+
 result_stream = None
+writer = None
 
 
 def get_result_stream():
     return result_stream
 
 
-def open_result_stream():
+def open_result_stream(closefd=True):
+    """
+    :param closefd: False if the stream is opened in a subinterpreter, which should leave it open for the evaluator
+    """
     global result_stream
-    result_stream = open(3, "w")
+    result_stream = open(3, "w", closefd=closefd)
+
+
+class ResultWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.queue = Queue(MAX_QUEUED)
+        self._stats_lock = Lock()
+        self.reset_stats()
+        self._thread = Thread(target=self._write_results, name="arepl_result_writer", daemon=True)
+        self._thread.start()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {
+                "results": 0,
+                "batches": 0,
+                "maxQueueDepth": 0,
+                # seconds spent writing to the pipe, which is mostly waiting for node to read it
+                "backpressureTime": 0,
+                # seconds user code waited because the queue was full
+                "blockedTime": 0,
+            }
+
+    def put(self, result: str):
+        depth = self.queue.qsize() + 1
+        with self._stats_lock:
+            self.stats["maxQueueDepth"] = max(self.stats["maxQueueDepth"], depth)
+        if self.queue.full():
+            start = time()
+            self.queue.put(result)
+            with self._stats_lock:
+                self.stats["blockedTime"] += time() - start
+        else:
+            self.queue.put(result)
+
+    def drain(self):
+        """
+        waits until all queued results have been written
+        """
+        self.queue.join()
+
+    def _write_results(self):
+        broken = False
+        while True:
+            batch = [self.queue.get()]
+            size = len(batch[0])
+            while size < BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get())
+                size += len(batch[-1])
+
+            start = time()
+            if not broken:
+                try:
+                    self.stream.write("\n".join(batch) + "\n")
+                    self.stream.flush()
+                except (OSError, ValueError):
+                    # node is gone, the results are dropped so drain doesn't wait forever
+                    broken = True
+            with self._stats_lock:
+                self.stats["backpressureTime"] += time() - start
+                self.stats["results"] += len(batch)
+                self.stats["batches"] += 1
+
+            for _ in batch:
+                self.queue.task_done()
+
+
+def start_writer():
+    global writer
+    writer = ResultWriter(result_stream)
+
+
+def write_result(result: str):
+    """
+    :param result: a result as a single line of JSON
+    """
+    if writer is None:
+        # without a result stream this prints to stdout, which is handy for debugging
+        print(result, file=result_stream, flush=True)
+    else:
+        writer.put(result)
+
+
+def drain():
+    if writer is not None:
+        writer.drain()
+
+
+def reset_stats():
+    if writer is not None:
+        writer.reset_stats()
+
+
+def get_stats():
+    """
+    :returns: stats of the writer since reset_stats, or None if results are written right away
+    """
+    if writer is None:
+        return None
+    with writer._stats_lock:
+        return dict(writer.stats)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 
 
 class Settings(object):
@@ -8,12 +8,24 @@ class Settings(object):
         show_global_vars=True,
         default_filter_vars: List[str] = [],
         default_filter_types: List[str] = [],
+        expand_rows: Dict[str, List[int]] = {},
+        use_subinterpreters=False,
+        max_output_kb=1024,
+        error_vars="full",
         *args,
         **kwargs,
     ):
         self.show_global_vars = show_global_vars
         self.default_filter_vars = default_filter_vars
         self.default_filter_types = default_filter_types
+        # rows to send in full for variables that are normally sent as a preview, ex: {"df": [0, 5000]}
+        self.expand_rows = expand_rows
+        # run each program in a fresh subinterpreter, see arepl_subinterpreter
+        self.use_subinterpreters = use_subinterpreters
+        # KB of output to keep of the start and of the end of a run, the rest is dropped. 0 for no limit
+        self.max_output_kb = max_output_kb
+        # variables sent when the code raises: "full", "summary" (the repr of each variable) or "none"
+        self.error_vars = error_vars
         # HALT! do NOT change this without changing corresponding type in the frontend! <----
 
 
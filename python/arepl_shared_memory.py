@@ -0,0 +1,68 @@
+import os
+from secrets import token_hex
+
+#####################################
+"""
+Big buffers are written to shared memory instead of being sent through the result pipe as base64.
+The result JSON just has a descriptor of the block, so the frontend can read the bytes directly.
+Only available on systems with /dev/shm (linux)
+"""
+#####################################
+
+SHARED_MEMORY_DIR = "/dev/shm"
+# buffers with at least this many bytes are written to shared memory
+SIZE_THRESHOLD = 1024 * 1024
+
+available = os.path.isdir(SHARED_MEMORY_DIR) and os.access(SHARED_MEMORY_DIR, os.W_OK)
+
+# blocks that have been written since the last release
+_block_paths = []
+
+
+def write_block(buf) -> dict:
+    """
+    writes a bytes-like object to a new shared memory block
+    :returns: descriptor of the block
+    """
+    view = memoryview(buf).cast("B")
+    # subinterpreters have their own copy of this module, so a counter would repeat the names of their blocks.
+    # The frontend frees the blocks of dead evaluators by the pid in the name
+    name = f"arepl_{os.getpid()}_{token_hex(8)}"
+    path = os.path.join(SHARED_MEMORY_DIR, name)
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    _block_paths.append(path)
+    try:
+        written = 0
+        while written < len(view):
+            written += os.write(fd, view[written:])
+    finally:
+        os.close(fd)
+
+    return {"name": name, "offset": 0, "length": len(view)}
+
+
+def get_block_paths() -> list:
+    """
+    :returns: paths of the blocks written since the last release
+    """
+    return list(_block_paths)
+
+
+def track_blocks(paths: list):
+    """
+    frees the blocks on the next release, for blocks written by a subinterpreter
+    """
+    _block_paths.extend(paths)
+
+
+def release_blocks():
+    """
+    frees the blocks of previous results.
+    The frontend frees blocks when it gets the next result, so they may be gone already
+    """
+    while _block_paths:
+        try:
+            os.unlink(_block_paths.pop())
+        except FileNotFoundError:
+            pass
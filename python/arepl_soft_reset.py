@@ -0,0 +1,219 @@
+import atexit
+import builtins
+import gc
+from importlib.machinery import EXTENSION_SUFFIXES, ExtensionFileLoader
+import locale
+import os
+import signal
+import socket
+import sys
+import threading
+from types import ModuleType
+import warnings
+
+#####################################
+"""
+Restarting python after every run is slow, but a run usually only changes state we can put back.
+A snapshot is taken once AREPL has started. After a run, a soft reset rolls the interpreter back to it:
+modules imported by the run are forgotten and sys.path, cwd, argv, builtins, std streams, os.environ,
+warning filters, trace and profile hooks, signal handlers and the decimal context are restored.
+This is not possible if the run imported C extensions (they can't be unloaded and may keep global state),
+left threads running, registered atexit functions, changed modules or classes that were already imported
+(ex: json.dumps = my_dumps) or changed process state like the gc, locale or umask,
+in which case the process has to be restarted.
+Changes to objects in place (ex: appending to a list of a module) are not detected,
+so soft resets are only used if the frontend opts in, see PythonExecutors.useSoftReset
+"""
+#####################################
+
+
+# sys and builtins are restored, the evaluator changes every run
+UNCHECKED_MODULES = ["sys", "builtins", "__main__"]
+_missing = object()
+
+
+def _get_umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def get_process_state() -> tuple:
+    """
+    :returns: the state of the interpreter and process that is not in the attributes of a module
+    """
+    return (
+        gc.isenabled(),
+        gc.get_threshold(),
+        gc.get_debug(),
+        locale.setlocale(locale.LC_ALL),
+        socket.getdefaulttimeout(),
+        sys.getswitchinterval(),
+        _get_umask(),
+    )
+
+
+class Snapshot:
+    def __init__(self):
+        self.modules = dict(sys.modules)
+        self.path = list(sys.path)
+        self.meta_path = list(sys.meta_path)
+        self.path_hooks = list(sys.path_hooks)
+        self.cwd = os.getcwd()
+        self.argv = list(sys.argv)
+        self.environ = dict(os.environ)
+        self.builtins = dict(vars(builtins))
+        self.std_streams = (sys.stdin, sys.stdout, sys.stderr)
+        self.hooks = (sys.displayhook, sys.excepthook)
+        self.recursion_limit = sys.getrecursionlimit()
+        self.thread_count = threading.active_count()
+        self.trace = sys.gettrace()
+        self.profile = sys.getprofile()
+        self.warning_filters = list(warnings.filters)
+        # None for handlers that were not set from python, which can't be restored
+        self.signal_handlers = {signum: signal.getsignal(signum) for signum in signal.valid_signals()}
+        self.atexit_count = atexit._ncallbacks()
+        decimal = sys.modules.get("decimal")
+        self.decimal_context = decimal.getcontext().copy() if decimal else None
+        # the attributes of the modules user code could change. arepl's own modules change every run
+        self.module_vars = {
+            name: (module, dict(vars(module)))
+            for name, module in self.modules.items()
+            if name not in UNCHECKED_MODULES and not name.startswith("arepl_") and hasattr(module, "__dict__")
+        }
+        # the attributes of the classes of those modules, ex: json.JSONEncoder.item_separator
+        self.class_vars = {
+            value: dict(vars(value))
+            for name, (module, attributes) in self.module_vars.items()
+            for value in attributes.values()
+            if isinstance(value, type) and value.__module__ == name
+        }
+        self.process_state = get_process_state()
+
+    def changed_modules(self) -> list:
+        """
+        :returns: names of the modules whose attributes were changed since the snapshot.
+            Importing a submodule (ex: json.tool) adds it to its package, which is not a change as restore undoes it
+        """
+        changed = []
+        for name, (module, attributes) in self.module_vars.items():
+            current = vars(module)
+            try:
+                if current == attributes:
+                    continue
+            except Exception:
+                # the == of some new value failed
+                pass
+            for key in current.keys() | attributes.keys():
+                value = current.get(key, _missing)
+                if value is attributes.get(key, _missing) or key == "__warningregistry__":
+                    continue
+                if key not in attributes and self.is_new_module(value):
+                    continue
+                changed.append(name)
+                break
+        return changed
+
+    def changed_classes(self) -> list:
+        """
+        :returns: the classes whose attributes were changed since the snapshot
+        """
+        changed = []
+        for cls, attributes in self.class_vars.items():
+            try:
+                if vars(cls) == attributes:
+                    continue
+            except Exception:
+                pass
+            changed.append(cls)
+        return changed
+
+    def is_new_module(self, value) -> bool:
+        return isinstance(value, ModuleType) and value.__name__ not in self.modules
+
+    def restore(self):
+        for name in [name for name in sys.modules if name not in self.modules]:
+            del sys.modules[name]
+        # in case the run replaced a module
+        sys.modules.update(self.modules)
+
+        sys.path[:] = self.path
+        sys.meta_path[:] = self.meta_path
+        sys.path_hooks[:] = self.path_hooks
+        sys.path_importer_cache.clear()
+        try:
+            os.chdir(self.cwd)
+        except os.error:
+            pass
+        sys.argv[:] = self.argv
+
+        if os.environ != self.environ:
+            os.environ.clear()
+            os.environ.update(self.environ)
+
+        builtins_vars = vars(builtins)
+        if builtins_vars != self.builtins:
+            builtins_vars.clear()
+            builtins_vars.update(self.builtins)
+
+        sys.stdin, sys.stdout, sys.stderr = self.std_streams
+        sys.displayhook, sys.excepthook = self.hooks
+        sys.setrecursionlimit(self.recursion_limit)
+        sys.settrace(self.trace)
+        sys.setprofile(self.profile)
+
+        # resetwarnings also makes warnings forget which warnings were already shown
+        warnings.resetwarnings()
+        warnings.filters[:] = self.warning_filters
+        for signum, handler in self.signal_handlers.items():
+            if handler is not None and signal.getsignal(signum) is not handler:
+                signal.signal(signum, handler)
+        if self.decimal_context is not None:
+            sys.modules["decimal"].setcontext(self.decimal_context.copy())
+        random = sys.modules.get("random")
+        if random is not None:
+            # a fresh process has a random seed, not the seed the run may have set
+            random.seed()
+
+        for module, attributes in self.module_vars.values():
+            current = vars(module)
+            if len(current) != len(attributes):
+                # submodules imported by the run, or the registry of warnings
+                for key in [key for key in current if key not in attributes]:
+                    del current[key]
+
+
+snapshot: Snapshot = None
+
+
+def take_snapshot():
+    global snapshot
+    snapshot = Snapshot()
+
+
+def is_c_extension(module) -> bool:
+    if isinstance(getattr(module, "__loader__", None), ExtensionFileLoader):
+        return True
+    file = getattr(module, "__file__", None) or ""
+    return file.endswith(tuple(EXTENSION_SUFFIXES))
+
+
+def can_soft_reset() -> bool:
+    """
+    :returns: whether the changes made since the snapshot can be rolled back
+    """
+    if snapshot is None:
+        return False
+    if threading.active_count() > snapshot.thread_count:
+        return False
+    if atexit._ncallbacks() > snapshot.atexit_count:
+        return False
+    if snapshot.changed_modules() or snapshot.changed_classes():
+        return False
+    if get_process_state() != snapshot.process_state:
+        return False
+    return not any(is_c_extension(module) for name, module in list(sys.modules.items()) if name not in snapshot.modules)
+
+
+def soft_reset():
+    snapshot.restore()
@@ -0,0 +1,214 @@
+from collections import deque
+from io import BufferedWriter, FileIO, TextIOWrapper
+from threading import Event, Lock, Thread, enumerate as enumerate_threads, main_thread
+from time import sleep
+
+#####################################
+"""
+Stdout for user code that batches writes instead of doing a write syscall per line.
+Output is flushed once BUFFER_SIZE bytes are buffered, and every FLUSH_INTERVAL seconds while user code
+(or a thread it started, which can print after the run) runs,
+so print-heavy code is much faster while users still see output in (nearly) real time.
+flush() flushes right away, like with any other stream.
+
+A run can also limit its output, in case it prints gigabytes (say in an accidental infinite loop).
+The first max bytes are sent as usual, after that only the last max bytes are kept, which are sent once the run is done.
+The output in between is dropped and replaced by TRUNCATED_MARKER.
+LimitedStdout only has the limit, for subinterpreters (which can't have the flusher thread).
+"""
+#####################################
+
+BUFFER_SIZE = 16 * 1024
+FLUSH_INTERVAL = 0.02
+TRUNCATED_MARKER = "[AREPL: {lines} lines ({bytes} bytes) of output were dropped]\n"
+
+
+class LimitedFileIO(FileIO):
+    """
+    Enforces the output limit. It is below the buffer, so write is only called once per BUFFER_SIZE bytes
+    """
+
+    def __init__(self, fd: int):
+        super().__init__(fd, "wb")
+        # written by the flusher thread too
+        self._lock = Lock()
+        self._tail = deque()
+        self._skip = 0
+        # bytes given to write, including dropped and skipped bytes
+        self.written = 0
+        self.limit(None)
+
+    def skip(self, skipped_bytes: int):
+        """
+        the next skipped_bytes bytes are not written, because they were already shown
+        """
+        with self._lock:
+            self._skip = skipped_bytes
+
+    def limit(self, max_bytes: int):
+        """
+        :param max_bytes: None or 0 for no limit
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._head_left = max_bytes
+            self._tail.clear()
+            self._tail_size = 0
+            self._dropped_bytes = 0
+            self._dropped_lines = 0
+            self._dropped_newline = False
+            self._head_ends_line = True
+
+    def end_limit(self):
+        """
+        sends the kept end of the output
+        :returns: how many bytes and lines were dropped, or None if nothing was
+        """
+        with self._lock:
+            dropped = None
+            tail = b"".join(self._tail)
+            if self._dropped_bytes:
+                # the end of the output starts at a new line, unless it is all one line
+                newline = tail.find(b"\n")
+                if not self._dropped_newline and -1 < newline < len(tail) - 1:
+                    self._drop(tail[: newline + 1])
+                    tail = tail[newline + 1 :]
+                dropped = {"bytes": self._dropped_bytes, "lines": self._dropped_lines}
+                if not self._head_ends_line:
+                    self._write_all(b"\n")
+                self._write_all(TRUNCATED_MARKER.format(**dropped).encode())
+            self._write_all(tail)
+            self.max_bytes = None
+            self._tail.clear()
+            self._tail_size = 0
+            return dropped
+
+    def _drop(self, data: bytes):
+        self._dropped_bytes += len(data)
+        self._dropped_lines += data.count(b"\n")
+        self._dropped_newline = data.endswith(b"\n")
+
+    def _write_all(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            view = view[super().write(view) :]
+
+    def write(self, b):
+        with self._lock:
+            if self._skip:
+                skipped = min(self._skip, len(b))
+                self._skip -= skipped
+                self.written += skipped
+                return skipped
+            written = self._write_limited(b)
+            self.written += written
+            return written
+
+    def _write_limited(self, b):
+        if not self.max_bytes:
+            return super().write(b)
+        if self._head_left > 0:
+            head = memoryview(b)[: self._head_left]
+            written = super().write(head)
+            self._head_left -= written
+            if written:
+                self._head_ends_line = head[written - 1] == ord("\n")
+            # BufferedWriter writes the rest again
+            return written
+
+        chunk = bytes(b)
+        self._tail.append(chunk)
+        self._tail_size += len(chunk)
+        while self._tail_size > self.max_bytes:
+            excess = self._tail_size - self.max_bytes
+            first = self._tail[0]
+            if len(first) <= excess:
+                self._tail.popleft()
+                dropped = first
+            else:
+                self._tail[0] = first[excess:]
+                dropped = first[:excess]
+            self._tail_size -= len(dropped)
+            self._drop(dropped)
+        return len(chunk)
+
+
+class LimitedStdout(TextIOWrapper):
+    def __init__(self, fd: int, encoding: str = None, buffer_size=BUFFER_SIZE, line_buffering=False):
+        super().__init__(
+            BufferedWriter(LimitedFileIO(fd), buffer_size), encoding=encoding, line_buffering=line_buffering
+        )
+
+    def limit_output(self, max_bytes: int):
+        """
+        :param max_bytes: bytes to keep of the start and of the end of the output, 0 for no limit
+        """
+        self.flush()
+        self.buffer.raw.limit(max_bytes)
+
+    def end_output_limit(self):
+        """
+        :returns: how many bytes and lines of output were dropped since limit_output, or None if nothing was
+        """
+        self.flush()
+        return self.buffer.raw.end_limit()
+
+    def skip_output(self, skipped_bytes: int):
+        """
+        leaves out the start of the next output, ex: the output of a run that was already shown
+        """
+        self.flush()
+        self.buffer.raw.skip(skipped_bytes)
+
+    def bytes_written(self) -> int:
+        self.flush()
+        return self.buffer.raw.written
+
+
+class CoalescingStdout(LimitedStdout):
+    """
+    write is not overridden, as a python level write would cost more than the syscalls it saves.
+    Instead a thread flushes periodically while flushing is on, so an idle evaluator doesn't keep waking up
+    """
+
+    def __init__(self, fd: int, encoding: str = None, buffer_size=BUFFER_SIZE, flush_interval=FLUSH_INTERVAL):
+        super().__init__(fd, encoding, buffer_size)
+        self.flush_interval = flush_interval
+        self._flushing = Event()
+        self._running = False
+        self._running_lock = Lock()
+        self._flusher = Thread(target=self._flush_periodically, name="arepl_stdout_flusher", daemon=True)
+        self._flusher.start()
+
+    def start_flushing(self):
+        with self._running_lock:
+            self._running = True
+            self._flushing.set()
+
+    def stop_flushing(self):
+        """
+        flushing goes on until the threads of the user are done, as they can still print
+        """
+        with self._running_lock:
+            self._running = False
+        self.flush()
+
+    def _flush_periodically(self):
+        while True:
+            self._flushing.wait()
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+                with self._running_lock:
+                    if self._running or _user_threads_alive():
+                        continue
+                    self._flushing.clear()
+                # the last thread may have printed right before it ended
+                self.flush()
+            except (OSError, ValueError):
+                # node closed the pipe or python is shutting down
+                return
+
+
+def _user_threads_alive():
+    return any(thread is not main_thread() and not thread.name.startswith("arepl_") for thread in enumerate_threads())
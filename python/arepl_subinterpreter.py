@@ -0,0 +1,132 @@
+import json
+import sys
+from types import SimpleNamespace
+
+import arepl_result_stream
+import arepl_shared_memory
+
+try:
+    from concurrent import interpreters  # pylint: disable=no-name-in-module
+
+    available = True
+except ImportError:
+    # python < 3.14
+    available = False
+
+#####################################
+"""
+Runs code in a fresh subinterpreter (PEP 734) inside the evaluator process, if the use_subinterpreters setting is on.
+A subinterpreter is isolated from the evaluator almost like a new process, but it is much cheaper to create.
+The interpreter of the next run is created (and imports arepl) once a run is done, so runs don't wait for it.
+Extension modules that don't support subinterpreters fail to import, in which case the code is ran normally.
+Output and dumps are sent right away like in the evaluator, with the same output limit.
+If the code has to be ran again the output that was already shown is skipped.
+The frontend remembers which files needed that, see subinterpreterUnsupported
+"""
+#####################################
+
+# in the ImportError raised when a module that doesn't support subinterpreters is imported
+UNSUPPORTED_MODULE_MESSAGE = "does not support loading in subinterpreters"
+
+# ran when the interpreter is created
+PRELUDE = """
+import os
+import sys
+
+sys.path[:] = arepl_path
+import arepl_result_stream
+import arepl_stdout
+
+# a subinterpreter can't have the daemon thread of CoalescingStdout, so output is flushed every line
+# stdout is a copy of the evaluator's, which the subinterpreter closes when it is closed
+stdout = arepl_stdout.LimitedStdout(os.dup(1), encoding=encoding, line_buffering=True)
+sys.stdout = stdout
+if has_result_stream:
+    # the result stream belongs to the evaluator, so the subinterpreter must not close it
+    arepl_result_stream.open_result_stream(closefd=False)
+
+import arepl_python_evaluator
+"""
+
+# ran for the run, puts the return info in the results queue and how many bytes it printed in the output queue,
+# and the paths of the shared memory blocks it wrote in the blocks queue, so the evaluator frees them
+RUNNER = """
+import json
+from types import SimpleNamespace
+
+import arepl_shared_memory
+
+try:
+    return_info = arepl_python_evaluator.run(json.loads(json_input))
+    results.put(json.dumps(return_info, default=lambda x: x.__dict__))
+finally:
+    output.put(stdout.bytes_written())
+    blocks.put(json.dumps(arepl_shared_memory.get_block_paths()))
+"""
+
+_prepared = None
+
+
+def prepare():
+    """
+    creates the interpreter of the next run, if it wasn't already
+    """
+    global _prepared
+    if _prepared is not None:
+        return
+    interpreter = interpreters.create()
+    try:
+        interpreter.prepare_main(
+            arepl_path=tuple(sys.path),
+            encoding=sys.stdout.encoding,
+            has_result_stream=arepl_result_stream.result_stream is not None,
+        )
+        interpreter.exec(PRELUDE)
+    except interpreters.ExecutionFailed:
+        interpreter.close()
+        raise
+    _prepared = interpreter
+
+
+def run(json_input: str):
+    """
+    runs the code in a new subinterpreter
+    :returns: the ReturnInfo as a namespace, or None if the code has to be ran in the evaluator instead,
+        and how many bytes of output were already shown
+    """
+    global _prepared
+    # the user output and results of the subinterpreter should come after any still buffered here
+    sys.stdout.flush()
+    arepl_result_stream.drain()
+
+    try:
+        prepare()
+    except interpreters.ExecutionFailed:
+        return None, 0
+    interpreter = _prepared
+    _prepared = None
+
+    results = interpreters.create_queue()
+    output = interpreters.create_queue()
+    blocks = interpreters.create_queue()
+    return_info = None
+    try:
+        interpreter.prepare_main(results=results, output=output, blocks=blocks, json_input=json_input)
+        interpreter.exec(RUNNER)
+        return_info = json.loads(results.get())
+    except interpreters.ExecutionFailed:
+        pass
+    finally:
+        try:
+            arepl_shared_memory.track_blocks(json.loads(blocks.get_nowait()))
+        except interpreters.QueueEmpty:
+            pass
+        try:
+            output_bytes = output.get_nowait()
+        except interpreters.QueueEmpty:
+            output_bytes = 0
+        interpreter.close()
+
+    if return_info is None or UNSUPPORTED_MODULE_MESSAGE in (return_info.get("userErrorMsg") or ""):
+        return None, output_bytes
+    return SimpleNamespace(**return_info), output_bytes
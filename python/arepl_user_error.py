@@ -1,14 +1,40 @@
-from arepl_pickler import pickle_user_vars
+import json
+import reprlib
+from functools import cached_property
 from traceback import TracebackException, FrameSummary
 from types import TracebackType
+
+from arepl_pickler import pickle_user_vars
 from arepl_settings import get_settings
+from arepl_var_filter import get_filter
+
+# repr of variables in a summary, long values are cut short
+SUMMARY_REPR = reprlib.Repr()
+SUMMARY_REPR.maxstring = 100
+SUMMARY_REPR.maxother = 100
+
+
+def summarize_vars(userVars: dict) -> str:
+    """
+    :returns: JSON of the repr of each variable, which is cheap and can't fail
+    """
+    settings = get_settings()
+    var_filter = get_filter(settings.default_filter_vars, settings.default_filter_types, userVars)
+    summary = {}
+    for name, value in userVars.items():
+        if name.startswith("__") or var_filter.is_filtered(name, value):
+            continue
+        try:
+            summary[name] = SUMMARY_REPR.repr(value)
+        except Exception:
+            summary[name] = f"<{type(value).__name__}>"
+    return json.dumps(summary, ensure_ascii=False)
 
 
 class UserError(Exception):
     """
     user errors should be caught and re-thrown with this
-    Be warned that this exception can throw an exception.  Yes, you read that right.  I apologize in advance.
-    :raises: ValueError (varsSoFar gets pickled into JSON, which may result in any number of errors depending on what types are inside)
+    The variables at the time of the error are only pickled once varsSoFar is used, depending on the error_vars setting
     """
 
     def __init__(self, exc_obj: BaseException, exc_tb: TracebackType, varsSoFar={}, execTime=0):
@@ -17,9 +43,7 @@ class UserError(Exception):
 
         self.traceback_exception = TracebackException(type(exc_obj), exc_obj, exc_tb)
         self.friendly_message = "".join(self.traceback_exception.format())
-        self.varsSoFar = pickle_user_vars(
-            varsSoFar, get_settings().default_filter_vars, get_settings().default_filter_types
-        )
+        self.userVars = varsSoFar
         self.execTime = execTime
 
         # stack is empty in event of a syntax error
@@ -29,3 +53,23 @@ class UserError(Exception):
             self.traceback_exception.stack.append(
                 FrameSummary(self.traceback_exception.filename, int(self.traceback_exception.lineno), "")
             )
+
+    @cached_property
+    def varsSoFar(self) -> str:
+        """
+        JSON of the variables at the time of the error. Never raises, if they can't be pickled they are summarized
+        """
+        error_vars = get_settings().error_vars
+        if error_vars == "none":
+            return "{}"
+        if error_vars == "full":
+            try:
+                return pickle_user_vars(
+                    self.userVars,
+                    get_settings().default_filter_vars,
+                    get_settings().default_filter_types,
+                    get_settings().expand_rows,
+                )
+            except Exception:
+                pass
+        return summarize_vars(self.userVars)
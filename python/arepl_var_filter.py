@@ -0,0 +1,101 @@
+import builtins
+from fnmatch import translate
+from functools import lru_cache
+import re
+import types
+from typing import Any, Dict, Iterable
+
+#####################################
+"""
+Decides which variables are not shown to the user.
+A filter comes from the default_filter_vars / default_filter_types settings and the arepl_filter / arepl_filter_type
+variables of the user. It is compiled once for each combination of them, not for every variable of every run:
+names go in a set, glob names (ex: "_*") and regexes (ex: re.compile("^tmp")) in a pattern list,
+and type names (ex: "<class 'module'>") are resolved to the types themselves where possible,
+so most variables are checked with a set lookup of their type instead of formatting str(type(value)).
+"""
+#####################################
+
+specialVars = ["__doc__", "__file__", "__loader__", "__name__", "__package__", "__spec__"]
+# only used for filtering, arepl_filter_function is left for the caller to run
+FILTER_VARS = ("arepl_filter", "arepl_filter_type", "arepl_filter_function")
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+
+
+def _known_types() -> Dict[str, type]:
+    known = {}
+    for module in (builtins, types):
+        for value in vars(module).values():
+            if isinstance(value, type):
+                known[str(value)] = value
+    return known
+
+
+# str(type) of builtin types and the types in the types module, ex: "<class 'function'>": FunctionType
+KNOWN_TYPES = _known_types()
+
+
+class VarFilter:
+    def __init__(self, filter_vars: Iterable, filter_types: Iterable[str]):
+        # never shown to the user
+        names = set(specialVars + ["__builtins__"])
+        names.update(FILTER_VARS)
+        globs = []
+        self.patterns = []
+        for name in filter_vars:
+            if isinstance(name, re.Pattern):
+                self.patterns.append(name.search)
+            elif isinstance(name, str):
+                if GLOB_CHARACTERS.search(name):
+                    globs.append(translate(name))
+                else:
+                    names.add(name)
+        if globs:
+            self.patterns.append(re.compile("|".join(globs)).match)
+        self.names = frozenset(names)
+
+        filter_types = [name for name in filter_types if isinstance(name, str)]
+        self.types = frozenset(KNOWN_TYPES[name] for name in filter_types if name in KNOWN_TYPES)
+        # types that are not builtin, like "<class 'pandas.core.frame.DataFrame'>", are compared by their name
+        self.type_names = frozenset(name for name in filter_types if name not in KNOWN_TYPES)
+
+    def is_filtered(self, name: str, value: Any) -> bool:
+        if name in self.names:
+            return True
+        value_type = type(value)
+        if value_type in self.types:
+            return True
+        if self.type_names and str(value_type) in self.type_names:
+            return True
+        return any(matches(name) for matches in self.patterns)
+
+    def filter(self, user_vars: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        :returns: the variables to show to the user
+        """
+        names = self.names
+        filtered_types = self.types
+        user_vars = {
+            name: value for name, value in user_vars.items() if name not in names and type(value) not in filtered_types
+        }
+        if self.type_names or self.patterns:
+            user_vars = {name: value for name, value in user_vars.items() if not self.is_filtered(name, value)}
+        return user_vars
+
+
+@lru_cache(maxsize=32)
+def compile_filter(filter_vars: tuple, filter_types: tuple) -> VarFilter:
+    return VarFilter(filter_vars, filter_types)
+
+
+def get_filter(default_filter_vars: Iterable = (), default_filter_types: Iterable[str] = (), user_vars={}) -> VarFilter:
+    """
+    :param user_vars: the variables of the user, which can add to the filters with arepl_filter and arepl_filter_type
+    """
+    filter_vars = tuple(default_filter_vars) + tuple(user_vars.get("arepl_filter", ()))
+    filter_types = tuple(default_filter_types) + tuple(user_vars.get("arepl_filter_type", ()))
+    try:
+        return compile_filter(filter_vars, filter_types)
+    except TypeError:
+        # the user put something unhashable in their filters, it can't be cached
+        return VarFilter(filter_vars, filter_types)
@@ -1,6 +1,10 @@
+from array import array
+from base64 import b64decode
 from json import loads
 
+import arepl_dump
 from arepl_dump import dump
+from arepl_python_evaluator import ReturnInfo
 
 # this test has to be in main scope
 # so we cant run it inside a function
@@ -53,17 +57,114 @@ def test_dump_at_list():
             assert output is None
 
 
-# This test fails but not sure how to fix it
-# I don't know of any easy way to make dump work with single line
-# def test_dump_same_line():
-#     # fmt: off
-#     dumpInfo = dump(1);dumpInfo2 = dump(2)
-#     # fmt: on
+def test_dump_same_line():
+    # fmt: off
+    dumpInfo = dump(1);dumpInfo2 = dump(2)  # noqa: E702
+    # fmt: on
 
-#     assert loads(dumpInfo.userVariables)["dump output"] == 1
-#     assert dumpInfo.caller == "test_dump_same_line"
-#     assert dumpInfo.done == False
+    assert loads(dumpInfo.userVariables)["dump output"] == 1
+    assert dumpInfo.caller == "test_dump_same_line"
+    assert not dumpInfo.done
 
-#     assert loads(dumpInfo2.userVariables)["dump output"] == 2
-#     assert dumpInfo2.caller == "test_dump_same_line"
-#     assert dumpInfo2.done == False
+    assert loads(dumpInfo2.userVariables)["dump output"] == 2
+    assert dumpInfo2.caller == "test_dump_same_line"
+    assert not dumpInfo2.done
+
+
+def end_run():
+    return_info = ReturnInfo("", "{}", None, None)
+    arepl_dump.end_run(return_info)
+    return return_info
+
+
+def test_dump_every():
+    arepl_dump.reset()
+    outputs = [dump(i, every=3) for i in range(10)]
+    assert [loads(output.userVariables)["dump output"] for output in outputs if output] == [0, 3, 6, 9]
+    assert end_run().dumpsSuppressed == 6
+
+
+def test_dump_min_interval():
+    arepl_dump.reset()
+    outputs = [dump(i, minIntervalMs=60 * 1000) for i in range(10)]
+    assert [loads(output.userVariables)["dump output"] for output in outputs if output] == [0]
+    assert end_run().dumpsSuppressed == 9
+
+
+def test_dump_last_only(monkeypatch):
+    arepl_dump.reset()
+    sent = []
+    monkeypatch.setattr(arepl_dump, "print_output", sent.append)
+    for i in range(10):
+        assert dump(i, lastOnly=True) is None
+    assert sent == []
+
+    assert end_run().dumpsSuppressed == 9
+    assert len(sent) == 1
+    assert loads(sent[0].userVariables)["dump output"] == 9
+    assert sent[0].count == 9
+    assert sent[0].caller == "test_dump_last_only"
+
+
+def test_dump_last_only_all_vars(monkeypatch):
+    arepl_dump.reset()
+    sent = []
+    monkeypatch.setattr(arepl_dump, "print_output", sent.append)
+
+    def loop():
+        for i in range(10):
+            dump(lastOnly=True)
+        i = "done"
+        return i
+
+    loop()
+    end_run()
+    assert loads(sent[0].userVariables)["i"] == "done"
+    assert sent[0].caller == "loop"
+    assert sent[0].lineno == loop.__code__.co_firstlineno + 2
+
+
+def test_dump_record_numbers():
+    arepl_dump.reset()
+    for i in range(5):
+        assert dump(i / 2, record=True) is None
+    [history] = loads(end_run().variableHistory)
+
+    assert history["caller"] == "test_dump_record_numbers"
+    assert history["count"] == 5
+    assert not history["ints"]
+    numbers = array("d", b64decode(history["numbers"]["values"]))
+    assert list(numbers) == [0, 0.5, 1, 1.5, 2]
+
+
+def test_dump_record_objects():
+    arepl_dump.reset()
+    for value in [1, "a", 1, "a", [1]]:
+        dump(value, record=True)
+    [history] = loads(end_run().variableHistory)
+
+    assert history["count"] == 5
+    assert history["objects"] == [1, "a", [1]]
+    assert list(array("I", b64decode(history["refs"]["values"]))) == [0, 1, 0, 1, 2]
+
+
+def test_dump_record_keeps_old_values():
+    arepl_dump.reset()
+    values = []
+    for i in range(2):
+        values.append(i)
+        dump(values, record=True)
+    [history] = loads(end_run().variableHistory)
+
+    assert history["objects"] == [[0], [0, 1]]
+    assert list(array("I", b64decode(history["refs"]["values"]))) == [0, 1]
+
+
+def test_dump_record_none():
+    arepl_dump.reset()
+    for value in [1, None, 2]:
+        dump(value, record=True)
+    [history] = loads(end_run().variableHistory)
+
+    assert history["objects"] == [1, None, 2]
+    assert list(array("I", b64decode(history["refs"]["values"]))) == [0, 1, 2]
@@ -1,6 +1,12 @@
+import json
+from base64 import b64decode
+from os import path
+
+import pytest
 import arepl_jsonpickle as jsonpickle
 
 import arepl_python_evaluator as python_evaluator
+from arepl_pickler import pickle_user_vars
 
 
 def test_frame_handler():
@@ -27,6 +33,25 @@ b.run('x=1+5',{},{})
     assert type(vars["f"]["f_lineno"]) is int
 
 
+def test_frame_handler_bounds_depth():
+    frame_code = """
+import sys
+
+def f(n):
+    return sys._getframe() if n == 0 else f(n - 1)
+
+frame = f(100)
+    """
+    return_info = python_evaluator.exec_input(python_evaluator.ExecArgs(frame_code))
+    frame = json.loads(return_info.userVariables)["frame"]
+    depth = 0
+    while isinstance(frame, dict):
+        frame = frame["f_back"]
+        depth += 1
+    assert depth == 20
+    assert frame == "older frames are not shown by arepl"
+
+
 def test_generator_handler():
     generator_code = """
 def count(start=0):
@@ -51,3 +76,123 @@ with open(__file__, encoding='cp1252') as f:
         '"f": {"py/object": "_io.TextIOWrapper", "write_through": false, "line_buffering": false, "errors": "strict", "encoding": "cp1252", "mode": "r"}'
         in return_info.userVariables
     )
+
+
+def test_numpy_array_sent_as_binary():
+    np = pytest.importorskip("numpy")
+    import arepl_numpy_handlers
+
+    arr = np.arange(arepl_numpy_handlers.BINARY_SIZE_THRESHOLD * 2, dtype=np.float64).reshape(2, -1)
+    vars = json.loads(pickle_user_vars({"arr": arr, "transposed": arr.T}))
+
+    assert vars["arr"]["shape"] == [2, arepl_numpy_handlers.BINARY_SIZE_THRESHOLD]
+    assert np.frombuffer(b64decode(vars["arr"]["values"]), dtype=vars["arr"]["dtype"]).tolist() == arr.ravel().tolist()
+    # views are sent as C-ordered copies rather than references to their base
+    assert "base" not in vars["transposed"]
+    transposed = np.frombuffer(b64decode(vars["transposed"]["values"]), dtype=vars["transposed"]["dtype"])
+    assert transposed.tolist() == arr.T.ravel().tolist()
+
+
+def test_big_numpy_array_goes_to_shared_memory():
+    np = pytest.importorskip("numpy")
+    import arepl_shared_memory
+
+    if not arepl_shared_memory.available:
+        pytest.skip("shared memory is not available on this system")
+
+    arr = np.arange(arepl_shared_memory.SIZE_THRESHOLD // 4, dtype=np.int32).reshape(2, -1)
+    vars = json.loads(pickle_user_vars({"arr": arr}))
+    descriptor = vars["arr"]["shm"]
+
+    with open(path.join(arepl_shared_memory.SHARED_MEMORY_DIR, descriptor["name"]), "rb") as f:
+        f.seek(descriptor["offset"])
+        shared = np.frombuffer(f.read(descriptor["length"]), dtype=vars["arr"]["dtype"])
+    assert shared.reshape(vars["arr"]["shape"]).tolist() == arr.tolist()
+    arepl_shared_memory.release_blocks()
+
+
+def test_big_dataframe_sent_as_preview():
+    pd = pytest.importorskip("pandas")
+    import arepl_pandas_handlers
+
+    rows = arepl_pandas_handlers.PREVIEW_ROW_THRESHOLD + 1
+    df = pd.DataFrame({"a": range(rows), "b": [None] + ["x"] * (rows - 1)})
+    vars = json.loads(pickle_user_vars({"df": df, "series": df["a"], "small_df": df.head()}))
+
+    assert vars["df"]["preview"] is True
+    assert vars["df"]["shape"] == [rows, 2]
+    assert vars["df"]["columns"] == ["a", "b"]
+    assert vars["df"]["null_counts"] == [0, 1]
+    assert vars["df"]["describe"] is not None
+    assert vars["series"]["preview"] is True
+    assert vars["series"]["null_count"] == 0
+    assert "preview" not in vars["small_df"]
+
+
+def test_expand_rows_sends_full_rows():
+    pd = pytest.importorskip("pandas")
+    import arepl_pandas_handlers
+
+    df = pd.DataFrame({"a": range(arepl_pandas_handlers.PREVIEW_ROW_THRESHOLD * 2)})
+    vars = json.loads(pickle_user_vars({"df": df}, expand_rows={"df": [10, 20]}))
+
+    assert "preview" not in vars["df"]
+    assert vars["df"]["py/object"] == jsonpickle.util.importable_name(pd.DataFrame)
+    assert vars["df"]["page"] == [10, 20]
+    assert vars["df"]["total_rows"] == len(df)
+
+
+def test_dataframe_round_trip():
+    pd = pytest.importorskip("pandas")
+    import arepl_pandas_handlers
+
+    index = ["x", "y", "z"]
+    df = pd.DataFrame(
+        {
+            "int": [1, 2, 3],
+            "float": [1.5, 2.5, 3.5],
+            "bool": [True, False, True],
+            "datetime": pd.date_range("2000-01-01", periods=3),
+            "str": ["a", "b", "c"],
+            "object": [[1], {"a": 1}, None],
+            "object_floats": pd.Series([1.5, 2.5, 3.5], dtype=object, index=index),
+            "object_mixed": pd.Series([2**53 + 1, 2.5, 3], dtype=object, index=index),
+        },
+        index=index,
+    )
+    # dataframes go through arrow if pyarrow is installed, so we use the handler directly
+    encoded = arepl_pandas_handlers.PandasDfHandler(jsonpickle.pickler.Pickler()).flatten_full(df, {})
+    blocks = json.loads(json.dumps(encoded))["blocks"]
+
+    # numeric columns are grouped by dtype into binary blocks, including object columns that only hold numbers
+    assert [block["dtype"] for block in blocks] == ["int64", "float64", "bool", str(df["datetime"].dtype), "object"]
+    assert blocks[1]["columns"] == [1, 6]
+    # ints and floats together would lose precision as float64
+    assert blocks[4]["columns"] == [4, 5, 7]
+    restored = arepl_pandas_handlers.PandasDfHandler(jsonpickle.unpickler.Unpickler()).restore(encoded)
+    assert restored.index.tolist() == df.index.tolist()
+    for col in ["int", "float", "bool", "datetime", "str", "object", "object_floats", "object_mixed"]:
+        assert restored[col].tolist() == df[col].tolist()
+
+
+def test_arrow_dataframe_falls_back_to_blocks():
+    pytest.importorskip("pyarrow")
+    pd = pytest.importorskip("pandas")
+    import arepl_arrow_pandas_handlers
+
+    big_ints = pd.DataFrame({"a": pd.Series([2**70, 2, 3], dtype=object)})
+    duplicate_columns = pd.DataFrame([[1, 2]], columns=["a", "a"])
+    for df in [big_ints, duplicate_columns]:
+        encoded = arepl_arrow_pandas_handlers.ArrowPandasDfHandler(jsonpickle.pickler.Pickler()).flatten_full(df, {})
+        assert "blocks" in encoded
+        assert "arrow_ipc" not in encoded
+
+
+def test_arrow_objects_sent_as_ipc():
+    pa = pytest.importorskip("pyarrow")
+
+    table = pa.table({"a": [1, 2, 3]})
+    vars = json.loads(pickle_user_vars({"table": table}))
+
+    assert vars["table"]["shape"] == [3, 1]
+    assert pa.ipc.open_stream(b64decode(vars["table"]["arrow_ipc"])).read_all().equals(table)
@@ -1,3 +1,16 @@
+import importlib.util
+import json
+import re
+from os import path
+import subprocess
+import sys
+from types import ModuleType
+
+import pytest
+
+import arepl_error_serializer
+import arepl_shared_memory
+import arepl_var_filter
 from arepl_pickler import pickle_user_vars, pickle_user_error
 import arepl_python_evaluator as python_evaluator
 import arepl_jsonpickle as jsonpickle
@@ -57,6 +70,57 @@ def test_custom_filter_function():
     assert "arepl_filter_function" not in vars
 
 
+def test_filters_dont_grow_between_runs():
+    filter_vars = ["dog"]
+    filter_types = ["<class 'module'>"]
+    pickle_user_vars({"arepl_filter": ["cat"], "arepl_filter_type": ["<class 'int'>"]}, filter_vars, filter_types)
+
+    assert filter_vars == ["dog"]
+    assert filter_types == ["<class 'module'>"]
+    vars = jsonpickle.decode(pickle_user_vars({"cat": 1, "dog": 2}, filter_vars, filter_types))
+    assert vars == {"cat": 1}
+
+
+def test_pattern_filters():
+    arepl_filter = ["_*", re.compile("^tmp")]
+    _private = 1
+    tmp_x = 2
+    x_tmp = 3
+    vars = jsonpickle.decode(pickle_user_vars(locals()))
+
+    assert vars == {"x_tmp": 3}
+
+
+def test_type_filter_by_name():
+    class Dog:
+        pass
+
+    arepl_filter_type = [str(Dog)]
+    dog = Dog()
+    cat = 2
+    vars = jsonpickle.decode(pickle_user_vars(locals()))
+
+    assert vars["cat"] == 2
+    assert "dog" not in vars
+
+
+def test_filter_is_compiled_once():
+    var_filter = arepl_var_filter.get_filter(["dog"], ["<class 'module'>"], {"arepl_filter": ["cat"]})
+
+    assert arepl_var_filter.get_filter(["dog"], ["<class 'module'>"], {"arepl_filter": ["cat"]}) is var_filter
+    assert var_filter.types == {ModuleType}
+    assert var_filter.is_filtered("cat", 1)
+
+
+def test_unhashable_filter():
+    arepl_filter = ["dog", ["not a name"]]
+    dog = 1
+    cat = 2
+    vars = jsonpickle.decode(pickle_user_vars(locals()))
+
+    assert vars == {"cat": 2}
+
+
 def test_jsonpickle_err_doesnt_break_arepl():
     class foo:
         def __getstate__(self):
@@ -120,3 +184,104 @@ except Exception as e:
         json = pickle_user_error(e.traceback_exception)
         assert "NameError" in json
         assert "ZeroDivisionError" in json
+
+
+def test_recursion_error_is_compact():
+    try:
+        python_evaluator.exec_input(python_evaluator.ExecArgs("def f(): f()\nf()"))
+    except python_evaluator.UserError as e:
+        error = json.loads(pickle_user_error(e.traceback_exception))
+        friendly_message = e.friendly_message
+
+    assert error["exc_type"]["py/type"] == "builtins.RecursionError"
+    frames = error["stack"]["py/seq"]
+    assert [frame["name"] for frame in frames] == ["<module>", "f", "f", "f"]
+    # the same number python shows in "[Previous line repeated N more times]"
+    assert f"repeated {frames[-1]['repeated']} more times" in friendly_message
+
+
+def test_long_traceback_is_bounded():
+    # every frame is on a different line, so they are not collapsed
+    code = "\n".join(f"def f{i}(): f{i + 1}()" for i in range(200)) + "\ndef f200(): 1/0\nf0()"
+    try:
+        python_evaluator.exec_input(python_evaluator.ExecArgs(code))
+    except python_evaluator.UserError as e:
+        error = json.loads(pickle_user_error(e.traceback_exception))
+
+    frames = error["stack"]["py/seq"]
+    omitted = 202 - arepl_error_serializer.MAX_FRAMES
+    assert len(frames) == arepl_error_serializer.MAX_FRAMES + 1
+    assert error["framesOmitted"] == omitted
+    assert frames[0]["name"] == "<module>"
+    assert frames[len(frames) // 2]["name"] == f"[{omitted} frames omitted]"
+    assert frames[-1]["name"] == "f200"
+
+
+def test_error_chain_is_serialized():
+    try:
+        python_evaluator.exec_input(
+            python_evaluator.ExecArgs("try:\n    1/0\nexcept ZeroDivisionError as e:\n    raise ValueError('a') from e")
+        )
+    except python_evaluator.UserError as e:
+        error = json.loads(pickle_user_error(e.traceback_exception))
+
+    assert error["exc_type"]["py/type"] == "builtins.ValueError"
+    assert error["__cause__"]["exc_type"]["py/type"] == "builtins.ZeroDivisionError"
+    assert error["cause"] == error["__cause__"]
+    assert error["context"] is None
+
+
+def test_big_bytes_go_to_shared_memory():
+    if not arepl_shared_memory.available:
+        pytest.skip("shared memory is not available on this system")
+
+    blob = b"a" * arepl_shared_memory.SIZE_THRESHOLD
+    descriptor = json.loads(pickle_user_vars(locals()))["blob"]["py/shm"]
+    block_path = path.join(arepl_shared_memory.SHARED_MEMORY_DIR, descriptor["name"])
+
+    with open(block_path, "rb") as f:
+        f.seek(descriptor["offset"])
+        assert f.read(descriptor["length"]) == blob
+
+    arepl_shared_memory.release_blocks()
+    assert not path.exists(block_path)
+
+
+def test_shared_memory_blocks_of_subinterpreters():
+    if not arepl_shared_memory.available:
+        pytest.skip("shared memory is not available on this system")
+
+    # each subinterpreter has its own copy of arepl_shared_memory
+    copies = []
+    for _ in range(2):
+        spec = importlib.util.find_spec("arepl_shared_memory")
+        copies.append(importlib.util.module_from_spec(spec))
+        spec.loader.exec_module(copies[-1])
+    names = [copy.write_block(b"a")["name"] for copy in copies]
+    assert names[0] != names[1]
+
+    # the paths are handed to the evaluator, which frees them
+    for copy in copies:
+        arepl_shared_memory.track_blocks(copy.get_block_paths())
+    arepl_shared_memory.release_blocks()
+    assert not any(path.exists(path.join(arepl_shared_memory.SHARED_MEMORY_DIR, name)) for name in names)
+
+
+def test_optional_libraries_not_imported_until_used():
+    pytest.importorskip("numpy")
+    code = """
+import sys
+from types import ModuleType
+import arepl_python_evaluator
+from arepl_pickler import pickle_user_vars
+print("numpy" in sys.modules)
+import numpy
+print(pickle_user_vars({"arr": numpy.arange(100)}))
+"""
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=path.dirname(path.abspath(__file__)), capture_output=True, text=True
+    ).stdout.splitlines()
+
+    assert output[0] == "False"
+    # the binary handler is registered once numpy is imported
+    assert isinstance(json.loads(output[1])["arr"]["values"], str)
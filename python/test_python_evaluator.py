@@ -1,10 +1,20 @@
+import json
+import os
 from os import path
+import subprocess
+import sys
 import tempfile
+import threading
+import time
 
 import pytest
 import arepl_jsonpickle as jsonpickle
 
 import arepl_python_evaluator as python_evaluator
+import arepl_result_stream
+import arepl_soft_reset
+import arepl_stdout
+import arepl_subinterpreter
 from arepl_settings import update_settings
 
 python_ignore_path = path.join(path.dirname(path.abspath(__file__)), "testDataFiles")
@@ -138,6 +148,20 @@ def test_starting_dunders_should_be_correct():
     assert jsonpickle.decode(return_info.userVariables)["loader_dunder"].path == "test path"
 
 
+def test_starting_dunders_should_not_leak_between_runs():
+    return_info = python_evaluator.exec_input(
+        python_evaluator.ExecArgs("__loader__.path='changed'\nglobal_doc=__doc__", filePath="test path")
+    )
+    assert jsonpickle.decode(return_info.userVariables)["global_doc"] is None
+
+    return_info = python_evaluator.exec_input(
+        python_evaluator.ExecArgs("loader_dunder=__loader__\nfile_dunder=__file__", filePath="other path")
+    )
+    user_variables = jsonpickle.decode(return_info.userVariables)
+    assert user_variables["loader_dunder"].path == "other path"
+    assert user_variables["file_dunder"] == "other path"
+
+
 def test_relative_import():
     file_path = path.join(python_ignore_path, "foo2.py")
     with open(file_path) as f:
@@ -152,6 +176,22 @@ def test_dump():
     assert jsonpickle.decode(return_info.userVariables)["x"] == 1
 
 
+def test_dump_counts_are_reset_every_run():
+    import arepl_dump
+
+    code = "from arepl_dump import dump\nfor i in range(3): dump(i, 5)"
+    python_evaluator.exec_input(python_evaluator.ExecArgs(code))
+    python_evaluator.exec_input(python_evaluator.ExecArgs(code))
+    assert list(arepl_dump.context.values()) == [2]
+
+
+def test_suppressed_dumps_are_reported():
+    return_info = python_evaluator.run(
+        {"evalCode": "from arepl_dump import dump\nfor i in range(5): dump(i, every=2)", "filePath": ""}
+    )
+    assert return_info.dumpsSuppressed == 2
+
+
 def test_import_does_not_show():
     # we only show local vars to user, no point in showing modules
     return_info = python_evaluator.exec_input(python_evaluator.ExecArgs("import json"))
@@ -286,3 +326,345 @@ def integration_test_howdoi():
 #         randomVal = jsonpickle.decode(return_info['userVariables'])['l']
 #         return_info = python_evaluator.exec_input(python_evaluator.ExecArgs("z=3",code))
 #         randomVal = jsonpickle.decode(return_info['userVariables'])['l']
+
+
+def test_startup_times(monkeypatch):
+    monkeypatch.setenv("AREPL_SPAWN_TIME", str(int(python_evaluator.imports_start * 1000) - 50))
+    startup_times = python_evaluator.get_startup_times(0.001)
+
+    assert set(startup_times) == {"interpreter", "imports", "howdoi", "resultStream"}
+    assert 0.04 < startup_times["interpreter"] < 0.06
+    assert startup_times["resultStream"] == 0.001
+
+
+def test_bundle(tmp_path):
+    from arepl_build_bundle import build_bundle
+
+    bundle = build_bundle(str(tmp_path / "arepl.pyz"))
+    code = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import arepl_python_evaluator as python_evaluator
+import arepl_soft_reset
+import arepl_subinterpreter
+print(type(python_evaluator.__loader__).__name__)
+print(python_evaluator.exec_input(python_evaluator.ExecArgs("x = 1")).userVariables)
+"""
+    output = subprocess.run(
+        [sys.executable, "-c", code, bundle], cwd=str(tmp_path), capture_output=True, text=True
+    ).stdout.splitlines()
+
+    assert output[0] == "zipimporter"
+    assert jsonpickle.decode(output[1])["x"] == 1
+
+
+def test_soft_reset():
+    arepl_soft_reset.take_snapshot()
+    code = "import sys\nimport colorsys\nsys.path.append('foo')\nx = 1"
+    return_info = python_evaluator.main(json.dumps({**default_settings, "evalCode": code}))
+    assert return_info.softResettable
+    assert "colorsys" in sys.modules
+
+    python_evaluator.main(json.dumps({"softReset": True}))
+
+    assert "colorsys" not in sys.modules
+    assert "foo" not in sys.path
+    assert python_evaluator.exec_locals is None
+
+
+def test_soft_reset_restores_interpreter_state():
+    import decimal
+    import random
+    import warnings
+
+    random.seed(1)
+    first_random = random.random()
+    arepl_soft_reset.take_snapshot()
+    code = """
+import decimal, random, sys, warnings, json.tool
+warnings.simplefilter("error")
+decimal.getcontext().prec = 3
+random.seed(1)
+sys.settrace(lambda *args: None)
+"""
+    return_info = python_evaluator.main(json.dumps({**default_settings, "evalCode": code}))
+    assert return_info.softResettable
+
+    python_evaluator.main(json.dumps({"softReset": True}))
+
+    assert warnings.filters == arepl_soft_reset.snapshot.warning_filters
+    assert str(decimal.Decimal(1) / 7) != "0.143"
+    assert random.random() != first_random
+    assert sys.gettrace() is arepl_soft_reset.snapshot.trace
+    assert not hasattr(json, "tool")
+
+
+def test_no_soft_reset_after_changing_imported_modules():
+    arepl_soft_reset.take_snapshot()
+    code = "import json\njson.dumps = lambda *args, **kwargs: 'patched'"
+    try:
+        return_info = python_evaluator.main(json.dumps({**default_settings, "evalCode": code}))
+        assert not return_info.softResettable
+    finally:
+        json.dumps = arepl_soft_reset.snapshot.module_vars["json"][1]["dumps"]
+
+
+@pytest.mark.parametrize(
+    "code, undo",
+    [
+        ("import json\njson.JSONEncoder.item_separator = ';'", "json.JSONEncoder.item_separator = ', '"),
+        ("import gc\ngc.disable()", "gc.enable()"),
+        ("import locale\nlocale.setlocale(locale.LC_ALL, 'C')", "locale.setlocale(locale.LC_ALL, snapshot_locale)"),
+        ("import socket\nsocket.setdefaulttimeout(5)", "socket.setdefaulttimeout(None)"),
+        ("import sys\nsys.setswitchinterval(0.1)", "sys.setswitchinterval(snapshot_interval)"),
+        ("import os\nos.umask(0o077)", "os.umask(snapshot_umask)"),
+    ],
+)
+def test_no_soft_reset_after_changing_process_state(code, undo):
+    import locale
+
+    arepl_soft_reset.take_snapshot()
+    undo_locals = {
+        "snapshot_locale": locale.setlocale(locale.LC_ALL),
+        "snapshot_interval": sys.getswitchinterval(),
+        "snapshot_umask": arepl_soft_reset._get_umask(),
+    }
+    try:
+        return_info = python_evaluator.main(json.dumps({**default_settings, "evalCode": code}))
+        assert not return_info.softResettable
+    finally:
+        exec(code.split("\n")[0] + "\n" + undo, undo_locals)
+    assert arepl_soft_reset.can_soft_reset()
+
+
+def test_no_soft_reset_with_running_threads():
+    arepl_soft_reset.take_snapshot()
+    code = "import threading\nstop = threading.Event()\nthreading.Thread(target=stop.wait, daemon=True).start()"
+    return_info = python_evaluator.main(json.dumps({**default_settings, "evalCode": code}))
+    jsonpickle.decode(return_info.userVariables)
+
+    assert not return_info.softResettable
+    python_evaluator.exec_locals["stop"].set()
+
+
+def test_no_soft_reset_after_importing_c_extensions():
+    if "_lsprof" in sys.modules:
+        pytest.skip("_lsprof is already imported")
+    arepl_soft_reset.take_snapshot()
+    return_info = python_evaluator.main(json.dumps({**default_settings, "evalCode": "import _lsprof"}))
+
+    assert arepl_soft_reset.is_c_extension(sys.modules["_lsprof"]) == (not return_info.softResettable)
+
+
+def test_use_subinterpreters_setting():
+    # without subinterpreter support the code is ran normally
+    code = "import sys\nx = 1"
+    return_info = python_evaluator.main(json.dumps({**default_settings, "evalCode": code, "use_subinterpreters": True}))
+    assert jsonpickle.decode(return_info.userVariables)["x"] == 1
+    assert return_info.subinterpreterUnsupported is False
+
+
+@pytest.mark.skipif(not arepl_subinterpreter.available, reason="subinterpreters need python 3.14+")
+def test_subinterpreter_is_isolated():
+    code = "import sys\nsys.arepl_test = 1\nx = 1"
+    return_info, _ = arepl_subinterpreter.run(json.dumps({**default_settings, "evalCode": code}))
+
+    assert jsonpickle.decode(return_info.userVariables)["x"] == 1
+    assert not hasattr(sys, "arepl_test")
+
+
+def test_shown_output_is_skipped():
+    read_end, write_end = os.pipe()
+    stdout = arepl_stdout.LimitedStdout(write_end)
+    with stdout:
+        print("shown", file=stdout)
+        stdout.skip_output(len("shown\n"))
+        print("shown", file=stdout)
+        print("new", file=stdout)
+        assert stdout.bytes_written() == len("shown\nshown\nnew\n")
+    assert os.read(read_end, 100) == b"shown\nnew\n"
+    os.close(read_end)
+
+
+def test_check_syntax():
+    result = python_evaluator.main(json.dumps({"compileOnly": True, "evalCode": "x="}))
+    assert result["syntaxError"]["msg"] == "invalid syntax"
+    assert result["syntaxError"]["lineno"] == 1
+    assert "SyntaxError" in result["syntaxError"]["formatted"]
+
+    result = python_evaluator.main(json.dumps({"compileOnly": True, "evalCode": "x = 1"}))
+    assert result["syntaxError"] is None
+    # the run uses the code compiled by the syntax check
+    compiled = python_evaluator.compiled_code[1]
+    assert python_evaluator.get_code("x = 1") is compiled
+    assert python_evaluator.get_code("x = 1") is not compiled
+
+
+def test_unchanged_ast_is_not_ran():
+    return_info = python_evaluator.exec_input(python_evaluator.ExecArgs("x = 1", skipUnchangedAst=True))
+    assert return_info.astLines == [1]
+
+    args = python_evaluator.ExecArgs(
+        "\n# comment\nx  =  (1)", previousAstHash=return_info.astHash, skipUnchangedAst=True
+    )
+    unchanged_info = python_evaluator.exec_input(args)
+    assert unchanged_info.astUnchanged
+    assert unchanged_info.astLines == [3]
+
+    args = python_evaluator.ExecArgs("x = 2", previousAstHash=return_info.astHash, skipUnchangedAst=True)
+    assert not python_evaluator.exec_input(args).astUnchanged
+
+    # off by default
+    args = python_evaluator.ExecArgs("x = 1", previousAstHash=return_info.astHash)
+    assert not python_evaluator.exec_input(args).astUnchanged
+
+
+def test_stdout_is_flushed_in_batches():
+    read_end, write_end = os.pipe()
+    os.set_blocking(read_end, False)
+    stdout = arepl_stdout.CoalescingStdout(write_end, flush_interval=0.05)
+    try:
+        stdout.start_flushing()
+        print("a", file=stdout)
+        with pytest.raises(BlockingIOError):
+            os.read(read_end, 100)
+        time.sleep(0.5)
+        assert os.read(read_end, 100) == b"a\n"
+        stdout.stop_flushing()
+
+        print("b", file=stdout, flush=True)
+        assert os.read(read_end, 100) == b"b\n"
+    finally:
+        stdout.close()
+        os.close(read_end)
+
+
+def test_stdout_is_flushed_after_the_run():
+    read_end, write_end = os.pipe()
+    stdout = arepl_stdout.CoalescingStdout(write_end, flush_interval=0.01)
+    try:
+        stdout.start_flushing()
+        timer = threading.Timer(0.1, lambda: print("a", file=stdout))
+        timer.start()
+        stdout.stop_flushing()
+        timer.join()
+        time.sleep(0.2)
+        assert os.read(read_end, 100) == b"a\n"
+        # no thread of the user is left, so the flusher is idle
+        assert not stdout._flushing.is_set()
+    finally:
+        stdout.close()
+        os.close(read_end)
+
+
+def test_output_limit_keeps_start_and_end():
+    read_end, write_end = os.pipe()
+    stdout = arepl_stdout.CoalescingStdout(write_end)
+    try:
+        stdout.limit_output(10)
+        for i in range(100):
+            print(i, file=stdout)
+        dropped = stdout.end_output_limit()
+        stdout.close()
+        with open(read_end) as output:
+            lines = output.read().splitlines()
+    finally:
+        stdout.close()
+
+    assert lines[:5] == ["0", "1", "2", "3", "4"]
+    # the end starts at a new line
+    assert lines[-3:] == ["97", "98", "99"]
+    assert dropped == {"bytes": 290 - 10 - 9, "lines": 100 - 5 - 3}
+    assert lines[5] == arepl_stdout.TRUNCATED_MARKER.format(**dropped).strip()
+    assert len(lines) == 5 + 1 + 3
+
+
+def test_output_limit_setting():
+    assert python_evaluator.get_settings().max_output_kb == 1024
+    update_settings({"max_output_kb": 0})
+    assert python_evaluator.get_settings().max_output_kb == 0
+    update_settings({})
+
+
+def test_result_writer_keeps_results_whole():
+    import threading
+
+    read_end, write_end = os.pipe()
+    with open(read_end) as reader, open(write_end, "w") as stream:
+        writer = arepl_result_stream.ResultWriter(stream)
+        results = [json.dumps({"thread": thread, "i": i, "data": "x" * 1000}) for thread in range(4) for i in range(50)]
+        threads = [
+            threading.Thread(target=lambda t=t: [writer.put(r) for r in results[t * 50 : t * 50 + 50]])
+            for t in range(4)
+        ]
+        # the pipe is read at the same time, as it can't hold all the results
+        received = []
+        reading = threading.Thread(target=lambda: received.extend(reader.readline() for _ in results))
+        reading.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.drain()
+        reading.join()
+
+    assert sorted(json.loads(line)["i"] + 50 * json.loads(line)["thread"] for line in received) == list(range(200))
+    assert writer.stats["results"] == 200
+    assert writer.stats["batches"] <= 200
+    assert writer.stats["maxQueueDepth"] >= 1
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="the result stream is passed as fd 3")
+def test_dump_is_written_before_exit():
+    code = "from arepl_dump import dump\ndump(1)\nimport os\nos._exit(0)"
+    read_end, write_end = os.pipe()
+    process = subprocess.Popen(
+        [sys.executable, "arepl_python_evaluator.py"],
+        cwd=path.dirname(path.abspath(__file__)),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        close_fds=False,
+        preexec_fn=lambda: os.dup2(write_end, 3),
+    )
+    os.close(write_end)
+    process.communicate(json.dumps({**default_settings, "evalCode": code}).encode() + b"\n")
+    with open(read_end) as result_stream:
+        results = [json.loads(line) for line in result_stream]
+
+    assert results[0]["startResult"]
+    assert jsonpickle.decode(results[1]["userVariables"])["dump output"] == 1
+
+
+def test_error_vars_setting():
+    code = "x = 1\ny = 'a' * 1000\nraise ValueError()"
+    for error_vars in ["none", "summary", "full"]:
+        return_info = python_evaluator.run({"evalCode": code, "error_vars": error_vars})
+        assert "ValueError" in return_info.userErrorMsg
+        variables = json.loads(return_info.userVariables)
+        if error_vars == "none":
+            assert variables == {}
+        elif error_vars == "summary":
+            assert variables["x"] == "1"
+            assert len(variables["y"]) <= 100
+        else:
+            assert variables["x"] == 1
+            assert variables["y"] == "a" * 1000
+
+
+def test_error_vars_are_summarized_if_they_cant_be_pickled():
+    code = "def arepl_filter_function(vars): raise Exception()\nx = 1\nraise ValueError()"
+    return_info = python_evaluator.run({"evalCode": code})
+    assert json.loads(return_info.userVariables)["x"] == "1"
+
+
+def test_error_is_sent_before_vars(monkeypatch):
+    sent = []
+    monkeypatch.setattr(arepl_result_stream, "write_result", lambda result: sent.append(json.loads(result)))
+    return_info = python_evaluator.run({"evalCode": "x = 1\nraise ValueError()"})
+
+    assert len(sent) == 1
+    assert sent[0]["varsPending"]
+    assert not sent[0]["done"]
+    assert sent[0]["userErrorMsg"] == return_info.userErrorMsg
+    assert json.loads(sent[0]["userVariables"]) == {}
+    assert json.loads(return_info.userVariables)["x"] == 1
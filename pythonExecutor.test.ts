@@ -6,8 +6,10 @@
 // The module 'assert' provides assertion methods from node
 import * as assert from 'assert'
 
-import { PythonExecutor, PythonState } from './pythonExecutor'
+import { PythonExecutor, PythonState, decodeBuffers } from './pythonExecutor'
 import { EOL } from 'os';
+import { deflateSync } from 'zlib';
+import { existsSync, writeFileSync, unlinkSync } from 'fs';
 
 function isEmpty(obj) {
 	return Object.keys(obj).length === 0;
@@ -33,6 +35,7 @@ suite("python_evaluator Tests", () => {
 		pyEvaluator.onPrint = () => { }
 		pyEvaluator.onStderr = () => { }
 		pyEvaluator.onResult = () => { }
+		pyEvaluator.onStateChange = () => { }
 		pyEvaluator.start(done)
 	})
 
@@ -86,6 +89,43 @@ suite("python_evaluator Tests", () => {
 		pyEvaluator.execCode(input)
 	})
 
+	test("decodes binary numpy arrays into typed arrays", function () {
+		const floats = new Float64Array([1.5, 2.5, 3.5, 4.5])
+		const ints = new Int32Array([1, 2, 3, 4])
+		const userVariables = decodeBuffers({
+			floats: { "py/object": "numpy.ndarray", values: Buffer.from(floats.buffer).toString('base64'), shape: [2, 2], dtype: "float64", byteorder: "<" },
+			nested: [{ "py/object": "numpy.ndarray", values: deflateSync(Buffer.from(ints.buffer)).toString('base64'), shape: [4], dtype: "int32", byteorder: "<", compression: "zlib" }],
+			small: { "py/object": "numpy.ndarray", values: [1, 2], dtype: "int64" },
+			table: { "py/object": "pyarrow.lib.Table", arrow_ipc: Buffer.from('arrow').toString('base64'), shape: [1, 1] }
+		})
+		assert.deepStrictEqual(userVariables.floats.values, floats)
+		assert.deepStrictEqual(userVariables.floats.shape, [2, 2])
+		assert.deepStrictEqual(userVariables.nested[0].values, ints)
+		assert.deepStrictEqual(userVariables.small.values, [1, 2])
+		assert.strictEqual(userVariables.table.arrow_ipc.toString(), 'arrow')
+	})
+
+	test("records variable history", function (done) {
+		pyEvaluator.onResult = (result) => {
+			const [history] = result.variableHistory
+			assert.strictEqual(history.count, 3)
+			assert.deepStrictEqual(history.numbers, new Float64Array([0, 0.5, 1]))
+			done()
+		}
+		input.evalCode = "from arepl_dump import dump\nfor i in range(3): dump(i/2, record=True)"
+		pyEvaluator.execCode(input)
+	})
+
+	test("reads buffers from shared memory", function () {
+		if (!existsSync('/dev/shm')) this.skip()
+		writeFileSync('/dev/shm/arepl_test_block', 'hello world')
+		const sharedBlocks = []
+		const userVariables = decodeBuffers({ x: { "py/shm": { name: 'arepl_test_block', offset: 6, length: 5 } } }, sharedBlocks)
+		unlinkSync('/dev/shm/arepl_test_block')
+		assert.strictEqual(userVariables.x.toString(), 'world')
+		assert.deepStrictEqual(sharedBlocks, ['arepl_test_block'])
+	})
+
 	suite("stdout/stderr tests", () => {
 
 		test("can print stdout", function (done) {
@@ -185,6 +225,21 @@ suite("python_evaluator Tests", () => {
 		})
 	})
 
+
+	test("frees the shared memory blocks of a killed evaluator", function (done) {
+		if (!existsSync('/dev/shm')) this.skip()
+		// a block of a result that never arrived
+		const blockPath = `/dev/shm/arepl_${pyEvaluator.pyshell.childProcess.pid}_unsent`
+		writeFileSync(blockPath, 'hello world')
+		pyEvaluator.pyshell.childProcess.on('exit', () => {
+			setTimeout(() => {
+				assert.strictEqual(existsSync(blockPath), false)
+				done()
+			}, 100)
+		})
+		pyEvaluator.stop(true)
+	})
+
 	test("no encoding errors with utf8 on windows", function (done) {
 		// other platforms may have the locale encoding
 		// so we just test windows
@@ -247,6 +302,17 @@ suite("python_evaluator Tests", () => {
 		input.evalCode = "y=x"
 	})
 
+	test("emits state changes", function (done) {
+		const states = []
+		pyEvaluator.onStateChange = state => states.push(state)
+		pyEvaluator.onResult = () => {
+			assert.deepStrictEqual(states, [PythonState.Executing, PythonState.DirtyFree])
+			done()
+		}
+		input.evalCode = "x=1"
+		pyEvaluator.execCode(input)
+	})
+
 	test("can restart", function (done) {
 
 		this.timeout(this.timeout() + pythonStartupTime)
@@ -261,6 +327,40 @@ suite("python_evaluator Tests", () => {
 		})
 	})
 
+	test("can soft reset", function (done) {
+		pyEvaluator.onResult = (result) => {
+			assert.strictEqual(result.softResettable, true)
+			pyEvaluator.softReset(() => {
+				assert.strictEqual(pyEvaluator.state, PythonState.FreshFree)
+				pyEvaluator.onResult = (result) => {
+					assert.strictEqual(result.userVariables['imported'], false)
+					done()
+				}
+				input.evalCode = "import sys\nimported = 'colorsys' in sys.modules"
+				pyEvaluator.execCode(input)
+			})
+		}
+		input.evalCode = "import colorsys"
+		pyEvaluator.execCode(input)
+	})
+
+	test("restarting while restarting only restarts once", function (done) {
+		this.timeout(this.timeout() + pythonStartupTime)
+
+		let starts = 0
+		let callbacks = 0
+		pyEvaluator.onStateChange = state => { if (state == PythonState.Starting) starts += 1 }
+		const restarted = () => {
+			callbacks += 1
+			if (callbacks == 2) {
+				assert.strictEqual(starts, 1)
+				done()
+			}
+		}
+		pyEvaluator.restart(restarted)
+		pyEvaluator.restart(restarted)
+	})
+
 	test("strips out unnecessary error info", function (done) {
 		pyEvaluator.onResult = (result) => {
 			assert.strictEqual(result.userErrorMsg, "Traceback (most recent call last):\n  line 1, in <module>\nNameError: name 'x' is not defined\n")
@@ -325,4 +425,29 @@ except Exception as e:
 		})
 	})
 
+	test("compiles code in the evaluator", function (done) {
+		pyEvaluator.compileCode("x=").then(syntaxError => {
+			assert.strictEqual(syntaxError.msg, 'invalid syntax')
+			assert.strictEqual(syntaxError.lineno, 1)
+			return pyEvaluator.compileCode("x=1")
+		}).then(syntaxError => {
+			assert.strictEqual(syntaxError, null)
+			done()
+		}).catch(done)
+	})
+
+	test("ignores syntax checks answered after the evaluator was killed", function () {
+		// the check was redirected when the evaluator was killed, but its answer was already in the pipe
+		pyEvaluator.handleResult(JSON.stringify({ syntaxCheck: true, syntaxError: null }))
+	})
+
+	test("doesn't use syntax check answers of killed evaluators for new checks", function (done) {
+		pyEvaluator.compileCode("x=").then(syntaxError => {
+			assert.strictEqual(syntaxError.msg, 'invalid syntax')
+			done()
+		}).catch(done)
+		// a killed evaluator answers a check that was redirected
+		pyEvaluator.handleResult(JSON.stringify({ syntaxCheck: true, syntaxError: null }), <any>{})
+	})
+
 })
@@ -1,6 +1,9 @@
 import { PythonShell, Options, NewlineTransformer } from 'python-shell'
-import { EOL } from 'os'
+import { EOL, endianness } from 'os'
 import { randomBytes } from 'crypto'
+import { inflateSync } from 'zlib'
+import { openSync, readSync, closeSync, unlink, existsSync, readdir, readdirSync, statSync } from 'fs'
+import { join } from 'path'
 
 export interface FrameSummary {
 	_line: string
@@ -8,14 +11,25 @@ export interface FrameSummary {
 	lineno: number
 	locals: {}
 	name: string
+	/**
+	 * number of identical frames after this one that were left out, like "[Previous line repeated 996 more times]"
+	 */
+	repeated?: number
+	/**
+	 * set on the frame that stands in for frames left out of the middle of a very long stack, see framesOmitted
+	 */
+	omitted?: number
 }
 
 export interface UserError {
 	__cause__: UserError
 	__context__: UserError
 	_str: string
-	cause: UserError
-	context: UserError
+	/**
+	 * same as __cause__ and __context__, only set on the outermost error
+	 */
+	cause?: UserError
+	context?: UserError
 	exc_traceback: {}
 	exc_type: {
 		"py/type": string
@@ -23,6 +37,14 @@ export interface UserError {
 	stack: {
 		"py/seq": FrameSummary[]
 	}
+	/**
+	 * frames left out of the middle of a very long stack
+	 */
+	framesOmitted?: number
+	/**
+	 * exceptions of an ExceptionGroup
+	 */
+	exceptions?: UserError[]
 	/* following for syntax errors only */
 	filename?: string
 	lineno?: string
@@ -37,7 +59,70 @@ export interface ExecArgs {
 	usePreviousVariables?: boolean,
 	show_global_vars?: boolean,
 	default_filter_vars: string[],
-	default_filter_types: string[]
+	default_filter_types: string[],
+	/**
+	 * Big pandas objects are sent as a preview.
+	 * Use this to get the full data for a range of rows, ex: {df: [1000, 2000]}
+	 */
+	expand_rows?: { [variableName: string]: [number, number] }
+	/**
+	 * Run each program in a fresh subinterpreter instead of the evaluator itself (python 3.14+).
+	 * Falls back to running normally if a module doesn't support subinterpreters or usePreviousVariables is set.
+	 * Output is shown once the run is done
+	 */
+	use_subinterpreters?: boolean
+	/**
+	 * astHash of the last run, set by PythonExecutors.
+	 * If the code has the same hash it is not ran and the result has astUnchanged set
+	 */
+	previousAstHash?: string
+	/**
+	 * Set to true to replay the last result instead of running code that only differs from the last run in comments
+	 * or formatting. The output can change even if the code didn't, for example if it uses the time or randomness
+	 * or reads a file or imports a module that was edited, so this is off by default
+	 */
+	skipUnchangedAst?: boolean
+	/**
+	 * KB of output to keep of the start and of the end of a run, the output in between is dropped.
+	 * 0 for no limit, defaults to 1024
+	 */
+	max_output_kb?: number
+	/**
+	 * variables to send if the code raises: the variables like after a normal run ('full', the default),
+	 * the repr of each variable ('summary') or none
+	 */
+	error_vars?: 'none' | 'summary' | 'full'
+}
+
+/**
+ * A SyntaxError found by PythonExecutor.compileCode
+ */
+export interface SyntaxErrorInfo {
+	msg: string,
+	lineno: number,
+	offset: number,
+	endLineno: number,
+	endOffset: number,
+	text: string,
+	/**
+	 * the error as python would print it
+	 */
+	formatted: string,
+}
+
+/**
+ * How PythonExecutors.scheduleCode decided when to run code.
+ * immediate: the run is expected to be fast, so it was sent right away
+ * debounce: the run is expected to be slow, so edits were coalesced for delay ms
+ * waitForRun: the previous run was close to finishing, so it was allowed to finish (which took delay ms)
+ */
+export interface RunSchedule {
+	decision: 'immediate' | 'debounce' | 'waitForRun',
+	delay: number,
+	/**
+	 * average totalTime in ms of previous runs of the file, null if there are none
+	 */
+	expectedTime: number,
 }
 
 export interface PythonResult {
@@ -52,9 +137,234 @@ export interface PythonResult {
 	lineno: number,
 	done: boolean,
 	startResult: boolean,
+	/**
+	 * ms taken by each phase of starting the evaluator, only sent in the start result
+	 */
+	startupTimes?: { [phase: string]: number },
+	/**
+	 * ms the code waited for a free executor, set by PythonExecutors
+	 */
+	queueTime?: number,
+	/**
+	 * whether the evaluator can be soft reset after this run, see softReset
+	 */
+	softResettable?: boolean,
+	/**
+	 * set if the code was sent through PythonExecutors.scheduleCode
+	 */
+	schedule?: RunSchedule,
+	/**
+	 * hash of the code ignoring comments and formatting, and the lines the code is on
+	 */
+	astHash?: string,
+	astLines?: number[],
+	/**
+	 * the code had the previousAstHash so it was not ran.
+	 * PythonExecutors replaces the result with the one of the last run
+	 */
+	astUnchanged?: boolean,
+	/**
+	 * set if output was dropped because of max_output_kb.
+	 * The output has a line saying how much was dropped where it was
+	 */
+	outputTruncated?: { bytes: number, lines: number },
+	/**
+	 * calls of dump that were not dumped because of its every, minIntervalMs or lastOnly options
+	 */
+	dumpsSuppressed?: number,
+	/**
+	 * values recorded by each dump(variable, record=True) of the run
+	 */
+	variableHistory?: VariableHistory[],
+	/**
+	 * how the results of the run were written to the result stream. Times are in seconds
+	 */
+	resultStreamStats?: { results: number, batches: number, maxQueueDepth: number, backpressureTime: number, blockedTime: number },
+	/**
+	 * If the code raises the error is sent right away, in a result with varsPending set and done unset.
+	 * The final result follows once the variables are pickled
+	 */
+	varsPending?: boolean,
+	/**
+	 * the code imported a module that doesn't support subinterpreters, so it was ran again in the evaluator.
+	 * Later runs of the file skip the subinterpreter, see PythonExecutor.subinterpreterUnsupportedFiles
+	 */
+	subinterpreterUnsupported?: boolean,
 	evaluatorName: string,
 }
 
+/**
+ * Values recorded by a dump(variable, record=True), one per call
+ */
+export interface VariableHistory {
+	caller: string,
+	lineno: number,
+	count: number,
+	/**
+	 * the values, if they are all numbers
+	 */
+	numbers?: Float64Array,
+	ints?: boolean,
+	/**
+	 * otherwise the index in objects of each value
+	 */
+	refs?: Uint32Array,
+	objects?: any[],
+}
+
+/**
+ * Where python puts a buffer in shared memory instead of the result JSON
+ */
+export interface SharedBlock {
+	name: string
+	offset: number
+	length: number
+}
+
+/**
+ * numpy array sent as binary. values is base64 in the JSON and a typed array after decoding.
+ * Really big arrays are put in shared memory, in which case shm is set instead of values.
+ */
+export interface NumpyArray {
+	"py/object": "numpy.ndarray"
+	dtype: string
+	shape: number[]
+	byteorder?: string
+	compression?: string
+	shm?: SharedBlock
+	values: string | Buffer | ArrayLike<number | bigint>
+}
+
+const typedArrayConstructors = {
+	bool: Uint8Array,
+	int8: Int8Array,
+	uint8: Uint8Array,
+	int16: Int16Array,
+	uint16: Uint16Array,
+	int32: Int32Array,
+	uint32: Uint32Array,
+	int64: BigInt64Array,
+	uint64: BigUint64Array,
+	float32: Float32Array,
+	float64: Float64Array,
+}
+
+/**
+ * typed arrays for the typecodes of python arrays in variable history
+ */
+const arrayTypecodes = {
+	d: Float64Array,
+	I: Uint32Array,
+}
+
+const nativeByteOrder = endianness() == 'LE' ? '<' : '>'
+
+const sharedMemoryFolder = '/dev/shm'
+
+/**
+ * frees every shared memory block of an evaluator process, including those of results that never arrived
+ * (ex: it was killed while pickling). Python puts the pid in the names of the blocks
+ */
+function freeProcessBlocks(pid: number) {
+	const prefix = `arepl_${pid}_`
+	readdir(sharedMemoryFolder, (err, names) => {
+		if (err) return
+		names.filter(name => name.startsWith(prefix))
+			.forEach(name => unlink(join(sharedMemoryFolder, name), () => { }))
+	})
+}
+
+/**
+ * @returns the latest modification time of the modules of the evaluator, in ms.
+ * Only the top level arepl_*.py files are checked, as this is done on every start
+ */
+function latestSourceChange(folder: string): number {
+	return Math.max(0, ...readdirSync(folder)
+		.filter(name => name.startsWith('arepl_') && name.endsWith('.py'))
+		.map(name => statSync(join(folder, name)).mtimeMs))
+}
+
+function readSharedBlock(block: SharedBlock): Buffer {
+	const fd = openSync(join(sharedMemoryFolder, block.name), 'r')
+	try {
+		const buf = Buffer.alloc(block.length)
+		readSync(fd, buf, 0, block.length, block.offset)
+		return buf
+	} finally {
+		closeSync(fd)
+	}
+}
+
+function toTypedArray(typedArray, buf: Buffer) {
+	if (buf.byteOffset % typedArray.BYTES_PER_ELEMENT == 0) {
+		return new typedArray(buf.buffer, buf.byteOffset, buf.byteLength / typedArray.BYTES_PER_ELEMENT)
+	}
+	// slice copies the bytes into their own ArrayBuffer, which guarantees alignment
+	return new typedArray(buf.buffer.slice(buf.byteOffset, buf.byteOffset + buf.byteLength))
+}
+
+/**
+ * Turns binary values in user variables into something usable:
+ * numpy arrays get typed arrays (Float64Array, Int32Array, etc.) as values,
+ * bytes in shared memory ({"py/shm": block}) are replaced with a Buffer,
+ * and arrow_ipc (tables/dataframes sent as Arrow IPC stream) becomes a Buffer you can pass to apache-arrow's tableFromIPC.
+ * Arrays are C-ordered, use shape to index into them.
+ * Arrays with a dtype that has no typed array equivalent are left as-is.
+ * Modifies obj in place.
+ * @param sharedBlocks names of the shared memory blocks that were read get appended to this
+ */
+export function decodeBuffers(obj: any, sharedBlocks: string[] = []): any {
+	if (obj === null || typeof obj != 'object') return obj
+
+	if (obj['py/shm']) {
+		sharedBlocks.push(obj['py/shm'].name)
+		return readSharedBlock(obj['py/shm'])
+	}
+
+	if (obj['py/object'] == 'numpy.ndarray' && (typeof obj.values == 'string' || obj.shm)) {
+		const typedArray = typedArrayConstructors[obj.dtype]
+		if (typedArray && (!obj.byteorder || obj.byteorder == nativeByteOrder)) {
+			let buf: Buffer
+			if (obj.shm) {
+				sharedBlocks.push(obj.shm.name)
+				buf = readSharedBlock(obj.shm)
+			}
+			else {
+				buf = Buffer.from(obj.values, 'base64')
+				if (obj.compression == 'zlib') buf = inflateSync(buf)
+			}
+			obj.values = toTypedArray(typedArray, buf)
+		}
+		else if (obj.shm) {
+			sharedBlocks.push(obj.shm.name)
+			obj.values = readSharedBlock(obj.shm)
+		}
+		return obj
+	}
+
+	if (typeof obj['py/array'] == 'string') {
+		let buf: Buffer
+		if (obj.shm) {
+			sharedBlocks.push(obj.shm.name)
+			buf = readSharedBlock(obj.shm)
+		}
+		else {
+			buf = Buffer.from(obj.values, 'base64')
+		}
+		return toTypedArray(arrayTypecodes[obj['py/array']], buf)
+	}
+
+	if (typeof obj.arrow_ipc == 'string') {
+		obj.arrow_ipc = Buffer.from(obj.arrow_ipc, 'base64')
+		return obj
+	}
+
+	for (const key of Object.keys(obj)) {
+		obj[key] = decodeBuffers(obj[key], sharedBlocks)
+	}
+	return obj
+}
+
 /**
  * Starting = Starting or restarting. 
  * Ending = Process is exiting. 
@@ -76,10 +386,44 @@ export class PythonExecutor {
 	// how long between SIGTERM and SIGKILL, in ms
 	static GRACE_PERIOD = 50
 
-	state: PythonState = PythonState.Starting
+	/**
+	 * precompiled zipapp of the evaluator, used instead of the loose files if it is newer than them.
+	 * Set the AREPL_USE_BUNDLE environment variable to 1 to always use it (if it exists) or 0 to never use it.
+	 * See python/arepl_build_bundle.py
+	 */
+	static readonly BUNDLE_NAME = 'arepl.pyz'
+
+	/**
+	 * files whose code imported a module that doesn't support subinterpreters.
+	 * They are ran in the evaluator right away, instead of paying for a subinterpreter that can't run them
+	 */
+	static subinterpreterUnsupportedFiles = new Set<string>()
+
+	private _state: PythonState = PythonState.Starting
 	finishedStartingCallback: Function
+	/**
+	 * callbacks of restart calls, invoked once the process has started again
+	 */
+	private restartCallbacks: Function[] = []
+	/**
+	 * whether the last run can be rolled back with a soft reset
+	 */
+	softResettable = false
+	/**
+	 * syntax checks sent to the evaluator, each python process answers its checks in order
+	 */
+	private pendingSyntaxChecks: { code: string, pyshell: PythonShell, resolve: (syntaxError: SyntaxErrorInfo) => void }[] = []
 	evaluatorName: string
 	private startTime: number
+	/**
+	 * ms taken by each phase of starting the evaluator
+	 */
+	startupTimes: { [phase: string]: number } = {}
+	/**
+	 * shared memory blocks of the last result, freed once the next result arrives
+	 */
+	private sharedBlocks: string[] = []
+	private runningFilePath: string
 
 	/**
 	 * an instance of python-shell. See https://github.com/extrabacon/python-shell
@@ -115,6 +459,16 @@ export class PythonExecutor {
 	}
 
 
+	get state() {
+		return this._state
+	}
+
+	set state(state: PythonState) {
+		if (state == this._state) return
+		this._state = state
+		this.onStateChange(state)
+	}
+
 	/**
 	 * does not do anything if program is currently executing code 
 	 */
@@ -125,6 +479,10 @@ export class PythonExecutor {
 		}
 		this.state = PythonState.Executing
 		this.startTime = Date.now()
+		this.runningFilePath = code.filePath
+		if (code.use_subinterpreters && PythonExecutor.subinterpreterUnsupportedFiles.has(code.filePath)) {
+			code = { ...code, use_subinterpreters: false }
+		}
 		this.pyshell.send(JSON.stringify(code) + EOL)
 	}
 
@@ -137,9 +495,22 @@ export class PythonExecutor {
 
 	/**
 	 * kills python process and restarts.  Force-kills if necessary after 50ms. 
-	 * After process restarts the callback passed in is invoked
+	 * After process restarts the callback passed in is invoked.
+	 * If the process is already starting or restarting it is left alone
 	 */
 	restart(callback = () => { }) {
+		this.restartCallbacks.push(callback)
+		if (this.state == PythonState.Starting || this.restartCallbacks.length > 1) {
+			// killing it again would only delay it
+			return
+		}
+
+		const childProcess = this.pyshell.childProcess
+		if (childProcess.exitCode !== null || childProcess.signalCode !== null) {
+			// process already died, there is no exit to wait for
+			this.start(() => { })
+			return
+		}
 
 		this.state = PythonState.Ending
 
@@ -147,10 +518,30 @@ export class PythonExecutor {
 		// using childProcess callback instead of pyshell callback
 		// (pyshell callback only happens when process exits voluntarily)
 		this.pyshell.childProcess.on('exit', () => {
-			this.start(callback)
+			// unless it was stopped in the meantime
+			if (this.restartCallbacks.length > 0) this.start(() => { })
 		})
 
-		this.stop()
+		this.kill()
+	}
+
+	/**
+	 * Rolls back the changes of the last run instead of restarting the process, which is much faster.
+	 * Restarts if the last run can't be rolled back (ex: it imported C extensions or left threads running)
+	 * After the reset the callback passed in is invoked
+	 */
+	softReset(callback = () => { }) {
+		if (this.state != PythonState.DirtyFree || !this.softResettable) {
+			this.restart(callback)
+			return
+		}
+
+		this.softResettable = false
+		this.state = PythonState.Starting
+		this.finishedStartingCallback = () => { }
+		this.restartCallbacks.push(callback)
+		this.startTime = Date.now()
+		this.pyshell.send(JSON.stringify({ softReset: true }) + EOL)
 	}
 
 	/**
@@ -158,7 +549,15 @@ export class PythonExecutor {
 	 * You can check python_evaluator.running to see if process is dead yet
 	 */
 	stop(kill_immediately=false) {
+		// cancels any restart in progress
+		this.restartCallbacks = []
+		this.kill(kill_immediately)
+	}
+
+	private kill(kill_immediately=false) {
 		this.state = PythonState.Ending
+		this.redirectSyntaxChecks()
+		this.freeSharedBlocks()
 		const kill_signal = kill_immediately ? 'SIGKILL' : 'SIGTERM'
 		this.pyshell.childProcess.kill(kill_signal)
 		
@@ -178,14 +577,22 @@ export class PythonExecutor {
 	 */
 	start(finishedStartingCallback) {
 		this.state = PythonState.Starting
+		this.softResettable = false
+		this.freeSharedBlocks()
 		console.log("Starting Python...")
 		this.finishedStartingCallback = finishedStartingCallback
 		this.startTime = Date.now()
-		this.pyshell = new PythonShell('arepl_python_evaluator.py', this.options)
+		// lets python measure how long the interpreter took to start
+		this.options.env.AREPL_SPAWN_TIME = String(this.startTime)
+		const script = this.useBundle() ? PythonExecutor.BUNDLE_NAME : 'arepl_python_evaluator.py'
+		this.pyshell = new PythonShell(script, this.options)
+		const pid = this.pyshell.childProcess.pid
+		if (pid !== undefined) this.pyshell.childProcess.on('exit', () => freeProcessBlocks(pid))
 
 		const resultPipe = this.pyshell.childProcess.stdio[3]
 		const newlineTransformer = new NewlineTransformer()
-		resultPipe.pipe(newlineTransformer).on('data', this.handleResult.bind(this))
+		const pyshell = this.pyshell
+		resultPipe.pipe(newlineTransformer).on('data', (results: string) => this.handleResult(results, pyshell))
 
 		this.pyshell.stdout.on('data', (message: Buffer) => {
 			this.onPrint(message.toString())
@@ -195,12 +602,28 @@ export class PythonExecutor {
 		})
 	}
 
+	/**
+	 * the bundle is skipped if the python files were changed after it was built, so it never runs stale code
+	 */
+	private useBundle() {
+		const bundlePath = join(this.options.scriptPath, PythonExecutor.BUNDLE_NAME)
+		if (process.env.AREPL_USE_BUNDLE == '0' || !existsSync(bundlePath)) return false
+		if (process.env.AREPL_USE_BUNDLE == '1') return true
+		return statSync(bundlePath).mtimeMs >= latestSourceChange(this.options.scriptPath)
+	}
+
 	/**
 	 * Overwrite this with your own handler.
 	 * is called when program fails or completes
 	 */
 	onResult(foo: PythonResult) { }
 
+	/**
+	 * Overwrite this with your own handler.
+	 * is called whenever the state of the executor changes
+	 */
+	onStateChange(foo: PythonState) { }
+
 	/**
 	 * Overwrite this with your own handler.
 	 * Is called when program prints
@@ -218,8 +641,9 @@ export class PythonExecutor {
 	/**
 	 * handles pyshell results and calls onResult / onPrint
 	 * @param {string} results 
+	 * @param pyshell the process that sent the results
 	 */
-	handleResult(results: string) {
+	handleResult(results: string, pyshell = this.pyshell) {
 		let pyResult: PythonResult = {
 			userError: null,
 			userErrorMsg: "",
@@ -236,22 +660,45 @@ export class PythonExecutor {
 		}
 
 		try {
-			pyResult = JSON.parse(results)
+			const message = JSON.parse(results)
+			if(message.syntaxCheck){
+				// none if the evaluator was killed after answering, its checks were redirected to new processes
+				const index = this.pendingSyntaxChecks.findIndex(pendingSyntaxCheck => pendingSyntaxCheck.pyshell === pyshell)
+				if (index != -1) this.pendingSyntaxChecks.splice(index, 1)[0].resolve(message.syntaxError)
+				return
+			}
+
+			this.freeSharedBlocks()
+			pyResult = message
 			if(pyResult.startResult){
-				console.log(`Finished starting in ${Date.now() - this.startTime}`)
+				this.startupTimes = {}
+				for (const phase in pyResult.startupTimes) {
+					this.startupTimes[phase] = pyResult.startupTimes[phase] * 1000 // convert into ms
+				}
+				console.log(`Finished starting in ${Date.now() - this.startTime}`, this.startupTimes)
 				this.state = PythonState.FreshFree
 				this.finishedStartingCallback()
+				const restartCallbacks = this.restartCallbacks
+				this.restartCallbacks = []
+				restartCallbacks.forEach(restartCallback => restartCallback())
 				return
 			}
 			if(pyResult['done'] == true){
-				this.state = PythonState.DirtyFree
+				this.softResettable = !!pyResult.softResettable
+				if (pyResult.subinterpreterUnsupported) PythonExecutor.subinterpreterUnsupportedFiles.add(this.runningFilePath)
+				// the code was not ran so the evaluator is still fresh
+				this.state = pyResult.astUnchanged ? PythonState.FreshFree : PythonState.DirtyFree
 			}
 
 			pyResult.execTime = pyResult.execTime * 1000 // convert into ms
 			pyResult.totalPyTime = pyResult.totalPyTime * 1000
 
 			//@ts-ignore pyResult.userVariables is sent to as string, we convert to object
-			pyResult.userVariables = JSON.parse(pyResult.userVariables)
+			pyResult.userVariables = decodeBuffers(JSON.parse(pyResult.userVariables), this.sharedBlocks)
+			if (pyResult.variableHistory) {
+				//@ts-ignore pyResult.variableHistory is sent as string, we convert to object
+				pyResult.variableHistory = decodeBuffers(JSON.parse(pyResult.variableHistory), this.sharedBlocks)
+			}
 			//@ts-ignore pyResult.userError is sent to as string, we convert to object
 			pyResult.userError = pyResult.userError ? JSON.parse(pyResult.userError) : {}
 
@@ -270,12 +717,51 @@ export class PythonExecutor {
 	}
 
 	/**
-	 * checks syntax without executing code
+	 * Python writes really big buffers to shared memory.
+	 * Once we are done with them we delete them so they don't take up memory
+	 */
+	private freeSharedBlocks() {
+		this.sharedBlocks.forEach(name => unlink(join(sharedMemoryFolder, name), () => { }))
+		this.sharedBlocks = []
+	}
+
+	/**
+	 * checks syntax without executing code.
+	 * The evaluator checks it if it is free, otherwise a new python process is spawned for the check
 	 * @param {string} code
 	 * @returns {Promise} rejects w/ stderr if syntax failure
 	 */
 	async checkSyntax(code: string) {
-		return PythonShell.checkSyntax(code);
+		if (this.state != PythonState.FreshFree && this.state != PythonState.DirtyFree) {
+			return PythonShell.checkSyntax(code);
+		}
+		const syntaxError = await this.compileCode(code)
+		if (syntaxError) throw syntaxError.formatted
+	}
+
+	/**
+	 * Compiles code in the evaluator without executing it. The evaluator has to be free.
+	 * If the next run is the same code it uses the compiled code.
+	 * @returns {Promise} resolves with the SyntaxError, or null if there is none
+	 */
+	compileCode(code: string): Promise<SyntaxErrorInfo> {
+		return new Promise(resolve => {
+			this.pendingSyntaxChecks.push({ code, pyshell: this.pyshell, resolve })
+			this.pyshell.send(JSON.stringify({ compileOnly: true, evalCode: code }) + EOL)
+		})
+	}
+
+	/**
+	 * the evaluator won't answer syntax checks once it is killed, so they are checked with a new process instead
+	 */
+	private redirectSyntaxChecks() {
+		const pendingSyntaxChecks = this.pendingSyntaxChecks
+		this.pendingSyntaxChecks = []
+		pendingSyntaxChecks.forEach(({ code, resolve }) => {
+			PythonShell.checkSyntax(code)
+				.then(() => resolve(null))
+				.catch(stderr => resolve({ msg: stderr, lineno: null, offset: null, endLineno: null, endOffset: null, text: null, formatted: stderr }))
+		})
 	}
 
 	/**
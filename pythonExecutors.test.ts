@@ -6,7 +6,7 @@
 // The module 'assert' provides assertion methods from node
 import * as assert from 'assert'
 
-import { PythonExecutors } from './pythonExecutors'
+import { PythonExecutors, remapLine } from './pythonExecutors'
 
 suite("PythonExecutors", () => {
 	let pyExecutors = new PythonExecutors()
@@ -16,7 +16,8 @@ suite("PythonExecutors", () => {
 		usePreviousVariables: false,
 		show_global_vars: true,
 		default_filter_vars: [],
-		default_filter_types: ["<class 'module'>", "<class 'function'>"]
+		default_filter_types: ["<class 'module'>", "<class 'function'>"],
+		skipUnchangedAst: false
 	}
 	const pythonStartupTime = 3000
 	const num_executors = 2
@@ -64,6 +65,102 @@ suite("PythonExecutors", () => {
 		pyExecutors.execCode(input)
 	})
 
+	test("reports queue time", function (done) {
+		pyExecutors.onResult = (result) => {
+			assert.ok(result.queueTime >= 0)
+			done()
+		}
+		input.evalCode = "x=1"
+		pyExecutors.execCode(input)
+	})
+
+	test("shrinks to minExecutors when idle", function (done) {
+		const idleTime = pyExecutors.idleTime
+		pyExecutors.idleTime = 100
+		pyExecutors.minExecutors = 1
+		let abnormalExits = 0
+		pyExecutors.onAbnormalExit = () => abnormalExits++
+		pyExecutors.onResult = () => {
+			setTimeout(() => {
+				assert.strictEqual(pyExecutors['executors'].length, 1)
+				// the removed executor was killed on purpose
+				assert.strictEqual(abnormalExits, 0)
+				pyExecutors.idleTime = idleTime
+				pyExecutors.minExecutors = 2
+				pyExecutors.onAbnormalExit = () => { }
+				done()
+			}, pyExecutors.idleTime * 2)
+		}
+		input.evalCode = "x=1"
+		pyExecutors.execCode(input)
+	})
+
+	test("schedules fast runs immediately", function (done) {
+		let num_results = 0
+		pyExecutors.onResult = (result) => {
+			num_results += 1
+			assert.strictEqual(result.schedule.decision, 'immediate')
+			if(num_results == 1){
+				pyExecutors.scheduleCode(input)
+			}
+			else{
+				assert.ok(result.schedule.expectedTime >= 0)
+				done()
+			}
+		}
+		input.evalCode = "x=1"
+		pyExecutors.scheduleCode(input)
+	})
+
+	test("debounces slow runs", function (done) {
+		let num_results = 0
+		pyExecutors.onResult = (result) => {
+			num_results += 1
+			if(num_results == 1){
+				// every run counts as slow
+				pyExecutors.fastRunTime = -1
+				pyExecutors.scheduleCode(input)
+			}
+			else{
+				pyExecutors.fastRunTime = 200
+				assert.strictEqual(result.schedule.decision, 'debounce')
+				assert.ok(result.schedule.delay <= pyExecutors.maxDebounce)
+				done()
+			}
+		}
+		input.evalCode = "x=1"
+		pyExecutors.execCode(input)
+	})
+
+	test("replays the last run if only comments changed", function (done) {
+		let num_results = 0
+		let prints = ""
+		pyExecutors.onPrint = print => prints += print
+		pyExecutors.onResult = (result) => {
+			num_results += 1
+			assert.strictEqual(result.userVariables['x'], 1)
+			if(num_results == 1){
+				assert.ok(!result.astUnchanged)
+				input.evalCode = "# comment\nx = 1\nprint('hi')"
+				pyExecutors.execCode(input)
+			}
+			else{
+				assert.ok(result.astUnchanged)
+				assert.strictEqual(prints, "hi\nhi\n")
+				input.skipUnchangedAst = false
+				done()
+			}
+		}
+		input.evalCode = "x=1\nprint('hi')"
+		input.skipUnchangedAst = true
+		pyExecutors.execCode(input)
+	})
+
+	test("remaps lines", function () {
+		assert.strictEqual(remapLine(1, [1, 3], [2, 5]), 2)
+		assert.strictEqual(remapLine(4, [1, 3], [2, 5]), 6)
+	})
+
 	test("last execution takes precedence", function (done) {
 		pyExecutors.onResult = (result) => {
 			assert.strictEqual(result.userVariables['x'], 2)
@@ -1,18 +1,117 @@
 import { Options, PythonShell } from "python-shell";
-import { ExecArgs, PythonExecutor, PythonResult, PythonState } from "./pythonExecutor";
+import { ExecArgs, PythonExecutor, PythonResult, PythonState, RunSchedule } from "./pythonExecutor";
 
 export * from './pythonExecutor'
 
+/**
+ * exponentially weighted moving average, recent values weigh more
+ */
+function ewma(average: number, value: number, weight = 0.3){
+	return average == null ? value : average + weight * (value - average)
+}
+
+/**
+ * maps a line of code to the line it moved to
+ * @param oldLines sorted lines with code before the edit
+ * @param newLines the same lines after the edit
+ */
+export function remapLine(line: number, oldLines: number[], newLines: number[]){
+	let i = oldLines.length - 1
+	while(i >= 0 && oldLines[i] > line) i--
+	if(i < 0) return line
+	return newLines[i] + (line - oldLines[i])
+}
+
+/**
+ * something the current executor sent during a run
+ */
+type RunEvent = { print: string } | { result: PythonResult }
+
 /**
  * Starts multiple python executors for running user code. 
  * Will manage them for you, so you can treat this class
  * as a single executor.
+ * The number of executors adapts to how long they take to restart and how fast the user edits.
  */
 export class PythonExecutors {
+	/**
+	 * bounds of the number of executors.
+	 * Two is enough when the user is not typing: one for the last run and one ready for the next run
+	 */
+	minExecutors = 2
+	maxExecutors = 6
+	/**
+	 * ms without edits after which the number of executors is brought down to minExecutors
+	 */
+	idleTime = 10000
+	/**
+	 * scheduleCode sends code right away if its runs are expected to take less ms than this
+	 */
+	fastRunTime = 200
+	/**
+	 * most ms scheduleCode waits for edits to stop before running slow code
+	 */
+	maxDebounce = 1000
+	/**
+	 * fraction of its expected time after which a run is considered close to finishing
+	 */
+	nearCompletion = 0.75
+	/**
+	 * Roll back executors after a run instead of restarting them, which is much faster.
+	 * Off by default: a soft reset restores the state python programs usually change and restarts if it
+	 * detects anything else, but it can't see every change (ex: objects changed in place), which could leak into the next run
+	 */
+	useSoftReset = false
+
 	private executors: PythonExecutor[] = []
-	private currentExecutorIndex: number = 0
-	private waitForFreeExecutor: NodeJS.Timeout
-	private wait_for_other_runs_to_complete: NodeJS.Timeout
+	private currentExecutor: PythonExecutor
+	private executorsStarted = 0
+	/**
+	 * latest code waiting for a free executor, older code is irrelevant so it is dropped
+	 */
+	private pendingCode: ExecArgs = null
+	private pendingSince: number
+	private queueTime = 0
+	/**
+	 * executors that were killed while running code and have not exited yet.
+	 * We don't want to run two programs at once, which could cause a race condition
+	 */
+	private killedMidRun = new Set<PythonExecutor>()
+	/**
+	 * when executors began (re)starting
+	 */
+	private startBegan = new Map<PythonExecutor, number>()
+	/**
+	 * averages in ms of the time it takes an executor to (re)start and of the time between edits
+	 */
+	private restartLatency: number = null
+	private editInterval: number = null
+	private lastEdit: number = null
+	private idleTimer: NodeJS.Timeout
+	/**
+	 * averages in ms of execTime and totalTime of the runs of each file
+	 */
+	private runTimes = new Map<string, { execTime: number, totalTime: number }>()
+	private pendingSchedule: RunSchedule = null
+	private runSchedule: RunSchedule = null
+	private runningFile: string
+	private runStarted: number
+	private scheduleTimer: NodeJS.Timeout
+	/**
+	 * code held back by scheduleCode until the current run is done
+	 */
+	private waitingCode: { code: ExecArgs, schedule: RunSchedule, since: number } = null
+	/**
+	 * prints and results of the current run, in the order they were received
+	 */
+	private runEvents: RunEvent[] = []
+	private runArgs: string
+	/**
+	 * last run that finished without errors.
+	 * Replayed if the next code only differs in comments or formatting
+	 * @param args the ExecArgs other than the code, the run is only valid for the same settings
+	 */
+	private lastRun: { args: string, astHash: string, astLines: number[], events: RunEvent[] } = null
 
 	constructor(public options: Options = {}){}
 
@@ -23,26 +122,96 @@ export class PythonExecutors {
 		if(this.executors.length != 0) throw Error('already started!')
 
 		for(let i = 0; i < numExecutors; i++){
-			console.log('starting executor ' + i.toString())
-			const pyExecutor = new PythonExecutor(this.options)
-			pyExecutor.start(()=>{})
-			pyExecutor.evaluatorName = i.toString()
-			pyExecutor.onResult = result => {
-				// Other executor may send a result right before it dies
-				// So we use this function to only capture result from active executor
-				if(i == this.currentExecutorIndex) this.onResult(result)
+			this.addExecutor()
+		}
+		this.currentExecutor = this.executors[0]
+	}
+
+	private addExecutor(){
+		const name = (this.executorsStarted++).toString()
+		console.log('starting executor ' + name)
+		const pyExecutor = new PythonExecutor(this.options)
+		pyExecutor.evaluatorName = name
+		pyExecutor.onResult = result => {
+			// Other executor may send a result right before it dies
+			// So we use this function to only capture result from active executor
+			if(pyExecutor == this.currentExecutor){
+				if(result.astUnchanged && this.lastRun){
+					this.replayLastRun(result)
+				}
+				else{
+					result.queueTime = this.queueTime
+					if(this.runSchedule) result.schedule = this.runSchedule
+					this.runEvents.push({ result })
+					if(result.done){
+						this.recordRunTime(result)
+						this.recordLastRun(result)
+					}
+					this.onResult(result)
+				}
+				if(result.done && this.waitingCode) this.runWaitingCode()
 			}
-			pyExecutor.onPrint = print => {
-				if(i == this.currentExecutorIndex) this.onPrint(print)
+		}
+		pyExecutor.onStateChange = state => {
+			// soft resets go straight to Starting
+			if((state == PythonState.Ending || state == PythonState.Starting) && !this.startBegan.has(pyExecutor)){
+				this.startBegan.set(pyExecutor, Date.now())
 			}
-			pyExecutor.onStderr = stderr => {
-				if(i == this.currentExecutorIndex) this.onStderr(stderr)
+			else if(state == PythonState.FreshFree && this.startBegan.has(pyExecutor)){
+				this.restartLatency = ewma(this.restartLatency, Date.now() - this.startBegan.get(pyExecutor))
+				this.startBegan.delete(pyExecutor)
+			}
+			// once a killed executor is starting again it has exited
+			if(state != PythonState.Ending) this.killedMidRun.delete(pyExecutor)
+			this.dispatch()
+		}
+		pyExecutor.onPrint = print => {
+			if(pyExecutor == this.currentExecutor){
+				this.runEvents.push({ print })
+				this.onPrint(print)
 			}
-			pyExecutor.pyshell.on('error', this.onError)
-			pyExecutor.pyshell.childProcess.on('exit', exitCode => {
-				if(exitCode != 0) this.onAbnormalExit(exitCode)
-			})
-			this.executors.push(pyExecutor)
+		}
+		pyExecutor.onStderr = stderr => {
+			if(pyExecutor == this.currentExecutor) this.onStderr(stderr)
+		}
+		this.startBegan.set(pyExecutor, Date.now())
+		pyExecutor.start(()=>{})
+		pyExecutor.pyshell.on('error', this.onError)
+		pyExecutor.pyshell.childProcess.on('exit', exitCode => {
+			// executors that were removed or stopped were killed on purpose
+			if(exitCode != 0 && this.executors.includes(pyExecutor)) this.onAbnormalExit(exitCode)
+		})
+		this.executors.push(pyExecutor)
+	}
+
+	private removeExecutor(executor: PythonExecutor){
+		this.executors = this.executors.filter(e => e != executor)
+		this.killedMidRun.delete(executor)
+		this.startBegan.delete(executor)
+		executor.onStateChange = () => { }
+		executor.stop(true)
+	}
+
+	/**
+	 * number of executors needed so there is always a fresh one for the next edit
+	 */
+	private targetSize(){
+		if(this.restartLatency == null || this.editInterval == null) return this.executors.length
+		// every edit uses up a fresh executor and it takes restartLatency for it to be fresh again,
+		// so we need an executor for each edit made during a restart, plus one for the current run
+		const needed = Math.ceil(this.restartLatency / this.editInterval) + 1
+		return Math.min(this.maxExecutors, Math.max(this.minExecutors, needed))
+	}
+
+	private resize(size: number){
+		while(this.executors.length < size) this.addExecutor()
+
+		// only fresh executors are removed. Removing a restarting executor (ex: one killed mid run)
+		// would leave the pool smaller than intended once the others are used up
+		const removable = this.executors
+			.filter(executor => executor != this.currentExecutor && executor.state == PythonState.FreshFree && !this.killedMidRun.has(executor))
+		while(this.executors.length > size && removable.length > 0){
+			this.removeExecutor(removable.shift())
 		}
 	}
 
@@ -51,69 +220,187 @@ export class PythonExecutors {
 	 * If current executor is busy, nothing happens
 	 */
 	execCodeCurrent(code: ExecArgs){
-		this.executors[this.currentExecutorIndex].execCode(code)
+		this.currentExecutor.execCode(code)
+	}
+
+	private recordRunTime(result: PythonResult){
+		const runTime = this.runTimes.get(this.runningFile)
+		this.runTimes.set(this.runningFile, {
+			execTime: ewma(runTime ? runTime.execTime : null, result.execTime),
+			totalTime: ewma(runTime ? runTime.totalTime : null, result.totalTime),
+		})
+	}
+
+	private recordLastRun(result: PythonResult){
+		if(result.userErrorMsg || result.internalError || !result.astHash){
+			this.lastRun = null
+			return
+		}
+		// prints can arrive after the result, so the events are not copied
+		this.lastRun = { args: this.runArgs, astHash: result.astHash, astLines: result.astLines, events: this.runEvents }
 	}
 
 	/**
-	 * sends code to a free executor to be executed
-	 * Side-effect: restarts dirty executors
+	 * sends the prints and results of the last run again, with their line numbers moved to where the code is now
+	 * @param unchanged the result of the run that was skipped
+	 */
+	private replayLastRun(unchanged: PythonResult){
+		const { astLines, events } = this.lastRun
+		this.lastRun.events = events.map(event => {
+			if(!('result' in event)) return event
+			return { result: { ...event.result, lineno: remapLine(event.result.lineno, astLines, unchanged.astLines) } }
+		})
+		this.lastRun.astLines = unchanged.astLines
+		this.runEvents = this.lastRun.events
+
+		this.runEvents.forEach(event => {
+			if(!('result' in event)){
+				this.onPrint(event.print)
+				return
+			}
+			const result: PythonResult = { ...event.result, queueTime: this.queueTime, evaluatorName: unchanged.evaluatorName }
+			delete result.schedule
+			if(this.runSchedule) result.schedule = this.runSchedule
+			if(result.done){
+				result.astUnchanged = true
+				result.execTime = unchanged.execTime
+				result.totalPyTime = unchanged.totalPyTime
+				result.totalTime = unchanged.totalTime
+			}
+			this.onResult(result)
+		})
+	}
+
+	/**
+	 * Sends code to a free executor when it is best to, depending on how long previous runs of the file took.
+	 * Fast code is sent right away, edits to slow code are coalesced,
+	 * and a slow run that is close to finishing is allowed to finish first.
+	 * Use this instead of debounce + execCode
 	 */
-	execCode(code: ExecArgs){
-		// old code is now irrelevant, if we are still waiting to send old code
-		// we should stop waiting
-		clearInterval(this.waitForFreeExecutor)
-		// this timeout should definitely not still be going on, but we clear it just in case
-		clearTimeout(this.wait_for_other_runs_to_complete)
+	scheduleCode(code: ExecArgs){
+		clearTimeout(this.scheduleTimer)
+		this.waitingCode = null
+
+		const runTime = this.runTimes.get(code.filePath)
+		const expectedTime = runTime ? runTime.totalTime : null
+		const schedule: RunSchedule = { decision: 'immediate', delay: 0, expectedTime }
 
-		let last_run_still_executing = false
-		if(this.executors.some(executor => executor.state == PythonState.Executing)){
-			last_run_still_executing = true
+		if(expectedTime == null || expectedTime < this.fastRunTime){
+			this.execCode(code, schedule)
+			return
 		}
-		// executors running old code are now irrelevant, restart them
-		this.executors.filter(executor => executor.state == PythonState.Executing || executor.state == PythonState.DirtyFree)
-			.forEach(executor => executor.restart())
-
-		if(last_run_still_executing){
-			// wait for last run to complete
-			// we don't want to run two programs at once
-			// which could cause a race condition
-			this.wait_for_other_runs_to_complete = setTimeout(this.exec_when_free_executor.bind(this, code), PythonExecutor.GRACE_PERIOD+5)
-		} else{
-			this.exec_when_free_executor(code)
+
+		const elapsed = Date.now() - this.runStarted
+		const running = this.currentExecutor.state == PythonState.Executing && this.runningFile == code.filePath
+		if(running && elapsed >= expectedTime * this.nearCompletion){
+			// the run is sent once the current run is done
+			// in case the current run takes longer than usual we give up waiting on it eventually
+			schedule.decision = 'waitForRun'
+			this.waitingCode = { code, schedule, since: Date.now() }
+			this.scheduleTimer = setTimeout(this.runWaitingCode.bind(this), expectedTime - elapsed + this.maxDebounce)
+			return
 		}
+
+		schedule.decision = 'debounce'
+		schedule.delay = Math.min(expectedTime * 0.25, this.maxDebounce)
+		this.scheduleTimer = setTimeout(this.execCode.bind(this, code, schedule), schedule.delay)
 	}
 
-	private exec_when_free_executor(code: ExecArgs){
-		let freeExecutor = this.executors.find(executor=>executor.state == PythonState.FreshFree)
-		if(!freeExecutor){
-			this.waitForFreeExecutor = setInterval(()=>{
-				freeExecutor = this.executors.find(executor=>executor.state == PythonState.FreshFree)
-				if(freeExecutor){
-					freeExecutor.execCode(code)
-					this.currentExecutorIndex = parseInt(freeExecutor.evaluatorName)
-					clearInterval(this.waitForFreeExecutor)
-				}
-			}, 60)
+	private runWaitingCode(){
+		clearTimeout(this.scheduleTimer)
+		const { code, schedule, since } = this.waitingCode
+		this.waitingCode = null
+		schedule.delay = Date.now() - since
+		this.execCode(code, schedule)
+	}
+
+	/**
+	 * sends code to a free executor to be executed
+	 * Side-effect: restarts dirty executors
+	 * @param schedule how scheduleCode decided to run the code, if it did
+	 */
+	execCode(code: ExecArgs, schedule: RunSchedule = null){
+		// old code is now irrelevant, if we are still waiting to send old code it is replaced
+		this.pendingCode = code
+		this.pendingSchedule = schedule
+		this.pendingSince = Date.now()
+		if(!schedule){
+			// code sent directly takes precedence over scheduled code
+			clearTimeout(this.scheduleTimer)
+			this.waitingCode = null
 		}
-		else{
-			freeExecutor.execCode(code)
-			this.currentExecutorIndex = parseInt(freeExecutor.evaluatorName)
+
+		if(this.lastEdit != null){
+			// a long pause is the user not typing, not a slow edit rate
+			this.editInterval = ewma(this.editInterval, Math.min(this.pendingSince - this.lastEdit, this.idleTime))
+		}
+		this.lastEdit = this.pendingSince
+
+		// executors running old code are now irrelevant, reset them
+		// executors that are still running are restarted, as they can't be soft reset
+		const irrelevantExecutors = this.executors.filter(executor => executor.state == PythonState.Executing || executor.state == PythonState.DirtyFree)
+		irrelevantExecutors.filter(executor => executor.state == PythonState.Executing)
+			.forEach(executor => this.killedMidRun.add(executor))
+		irrelevantExecutors.forEach(executor => this.useSoftReset ? executor.softReset() : executor.restart())
+
+		this.resize(this.targetSize())
+		clearTimeout(this.idleTimer)
+		this.idleTimer = setTimeout(() => this.resize(this.minExecutors), this.idleTime)
+
+		this.dispatch()
+	}
+
+	/**
+	 * sends the pending code to a free executor, if there is one.
+	 * Called whenever the state of an executor changes
+	 */
+	private dispatch(){
+		if(!this.pendingCode || this.killedMidRun.size > 0) return
+
+		const freeExecutor = this.executors.find(executor=>executor.state == PythonState.FreshFree)
+		if(!freeExecutor) return
+
+		let code = this.pendingCode
+		this.pendingCode = null
+		this.runArgs = JSON.stringify({ ...code, evalCode: undefined })
+		this.runEvents = []
+		// previous variables can change the result of the same code
+		if(this.lastRun && this.lastRun.args == this.runArgs && code.skipUnchangedAst && !code.usePreviousVariables){
+			code = { ...code, previousAstHash: this.lastRun.astHash }
 		}
+		this.queueTime = Date.now() - this.pendingSince
+		this.runSchedule = this.pendingSchedule
+		this.pendingSchedule = null
+		this.runningFile = code.filePath
+		this.runStarted = Date.now()
+		this.currentExecutor = freeExecutor
+		freeExecutor.execCode(code)
 	}
 
 	stop(kill_immediately=false){
-		clearInterval(this.waitForFreeExecutor)
+		clearTimeout(this.idleTimer)
+		clearTimeout(this.scheduleTimer)
+		this.waitingCode = null
+		this.pendingCode = null
+		this.lastRun = null
+		this.killedMidRun.clear()
+		this.startBegan.clear()
 		this.executors.forEach(executor => executor.stop(kill_immediately))
 		this.executors = []
 	}
 
 	/**
-	 * checks syntax without executing code
+	 * checks syntax without executing code.
+	 * A fresh executor checks it, so the run that follows can use the compiled code.
+	 * If no executor is free a new python process is spawned for the check
 	 * @param {string} code
 	 * @returns {Promise} rejects w/ stderr if syntax failure
 	 */
 	async checkSyntax(code: string) {
-		return PythonShell.checkSyntax(code);
+		const freeExecutor = this.executors.find(executor => executor.state == PythonState.FreshFree)
+			|| this.executors.find(executor => executor.state == PythonState.DirtyFree)
+		if (!freeExecutor) return PythonShell.checkSyntax(code);
+		return freeExecutor.checkSyntax(code)
 	}
 
 	/**